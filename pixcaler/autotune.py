@@ -0,0 +1,137 @@
+import copy
+import json
+import os
+import platform
+import time
+import warnings
+from pathlib import Path
+
+import fire
+import chainer
+
+import pixcaler.net
+from pixcaler.scaler import ChainerConverter, Refiner
+from pixcaler.bench.fixture import pixel_art
+
+DEFAULT_PROFILE = Path.home()/'.pixcaler'/'autotune.json'
+
+def profile_key(backend, gpu=-1):
+    return backend if gpu < 0 else '{}-gpu'.format(backend)
+
+def load_profile(path=DEFAULT_PROFILE):
+    '''
+    {backend key: {'batch_size', 'patch_size', ...}} saved by autotune, or {} if
+    there is none or it cannot be read (with a warning)
+    '''
+    path = Path(path)
+    if not path.exists():
+        return {}
+    try:
+        with path.open() as f:
+            backends = json.load(f)['backends']
+        if not isinstance(backends, dict) or not all(
+                isinstance(tuned, dict) and 'batch_size' in tuned and 'patch_size' in tuned
+                for tuned in backends.values()):
+            raise ValueError('backends is not a mapping of backend keys to batch and patch sizes')
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        warnings.warn('ignoring the autotune profile {} ({}: {}); run pixcaler.autotune again'.format(
+            path, type(e).__name__, e,
+        ))
+        return {}
+    return backends
+
+def _converters(gen, backends, gpu, threads):
+    for backend in backends:
+        if backend == 'chainer':
+            chainer_gen = gen
+            if gpu >= 0:
+                # move a copy, as the onnx backend exports gen from the CPU
+                # (Link.copy shares the arrays that to_gpu replaces)
+                chainer.cuda.get_device(gpu).use()
+                chainer_gen = copy.deepcopy(gen)
+                chainer_gen.to_gpu()
+            yield profile_key(backend, gpu), lambda patch_size: ChainerConverter(chainer_gen, patch_size * 2)
+        elif backend == 'onnx':
+            try:
+                import onnx, onnxruntime
+            except ImportError:
+                print('onnx: skipped (onnx or onnxruntime is not installed)')
+                continue
+            from pixcaler.onnx_backend import OnnxConverter, export_generator
+            model = export_generator(gen).SerializeToString()
+            yield backend, lambda patch_size: OnnxConverter(model, patch_size * 2, threads=threads)
+        else:
+            raise ValueError('unknown backend {}'.format(backend))
+
+def autotune(
+    generator=None,
+    backends=('chainer', 'onnx'),
+    batch_sizes=(1, 2, 4, 8, 16),
+    patch_sizes=(32, 64, 96),
+    image_size=256,
+    repeat=2,
+    freeze=False,
+    gpu=-1,
+    threads=None,
+    seed=0,
+    out=str(DEFAULT_PROFILE)):
+    '''
+    time the conversion of a synthetic pixel-art image for each batch size
+    and patch size of each backend and save the fastest configuration per
+    backend to out, which `python -m pixcaler.run` uses for --batch_size and
+    --patch_size when they are not given
+    (a randomly initialized Generator is used if generator is omitted;
+    its base_ch should match the generators converted later)
+    '''
+    backends = [backends] if isinstance(backends, str) else list(backends)
+    batch_sizes = [batch_sizes] if isinstance(batch_sizes, int) else list(batch_sizes)
+    patch_sizes = [patch_sizes] if isinstance(patch_sizes, int) else list(patch_sizes)
+    if generator is not None:
+        gen = pixcaler.net.load_generator(generator)
+    else:
+        gen = pixcaler.net.Generator(in_ch=4, out_ch=4)
+    if freeze:
+        gen = gen.freeze()
+    img = pixel_art(image_size, image_size, seed=seed)
+
+    tuned = {}
+    for key, make_converter in _converters(gen, backends, gpu, threads):
+        results = []
+        for patch_size in patch_sizes:
+            converter = make_converter(patch_size)
+            for batch_size in batch_sizes:
+                scaler = Refiner(converter, batch_size=batch_size)
+                scaler(img)
+                best = float('inf')
+                for _ in range(repeat):
+                    start = time.perf_counter()
+                    scaler(img)
+                    best = min(best, time.perf_counter() - start)
+                results.append({
+                    'batch_size': batch_size,
+                    'patch_size': patch_size,
+                    'seconds': best,
+                    'pixels_per_second': image_size ** 2 / best,
+                })
+                print('{:<12} patch_size={:<4} batch_size={:<4} {:>10.0f} px/s'.format(
+                    key, patch_size, batch_size, results[-1]['pixels_per_second'],
+                ))
+        fastest = min(results, key=lambda r: r['seconds'])
+        tuned[key] = dict(fastest, base_ch=gen.base_ch, freeze=freeze, results=results)
+        print('{}: --patch_size {} --batch_size {}'.format(key, fastest['patch_size'], fastest['batch_size']))
+
+    out = Path(out)
+    out.parent.mkdir(parents=True, exist_ok=True)
+    profile = {'backends': load_profile(out)}
+    profile['backends'].update(tuned)
+    profile['machine'] = {
+        'cpu_count': os.cpu_count(),
+        'processor': platform.processor(),
+        'platform': platform.platform(),
+    }
+    with out.open('w') as f:
+        json.dump(profile, f, indent=4, sort_keys=True)
+    print('saved to', out)
+
+if __name__ == '__main__':
+    fire.Fire(autotune)
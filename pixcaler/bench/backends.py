@@ -0,0 +1,89 @@
+import json
+import time
+from pathlib import Path
+
+import fire
+import numpy as np
+from PIL import Image
+
+import pixcaler.net
+from pixcaler.scaler import ChainerConverter
+from pixcaler.onnx_backend import OnnxConverter, export_generator
+from pixcaler.util import img_to_chw_array, extract_patches
+
+def _patches(input_dir, patch_size, n, seed):
+    '''
+    n input tiles of patch_size * 2 from the png images in input_dir,
+    or random ones if there are none
+    '''
+    size = patch_size * 2
+    tiles = []
+    for path in sorted(Path(input_dir).glob('*.png')):
+        with Image.open(str(path)) as img:
+            img = img.convert('RGBA')
+        if min(img.size) < size:
+            continue
+        x = img_to_chw_array(img)
+        tiles.extend(extract_patches(x, size, size).reshape((-1,) + (x.shape[0], size, size)))
+    random = np.random.RandomState(seed)
+    if not tiles:
+        return random.uniform(-1, 1, (n, 4, size, size)).astype(np.float32)
+    return np.asarray(tiles)[random.choice(len(tiles), n)]
+
+def _time(converter, x, batch_size, repeat):
+    converter.convert_array(x[:batch_size])
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        y = np.concatenate([converter.convert_array(x[i:i + batch_size]) for i in range(0, len(x), batch_size)])
+        best = min(best, time.perf_counter() - start)
+    return y, best
+
+def main(
+    generator=None,
+    input_dir='image/dataset/test',
+    patch_size=32,
+    batch_size=4,
+    n=32,
+    repeat=3,
+    threads=None,
+    seed=0,
+    out=None):
+    '''
+    output difference and throughput of OnnxConverter against
+    ChainerConverter on the same patches
+    (a randomly initialized Generator is used if generator is omitted)
+    '''
+    if generator is not None:
+        gen = pixcaler.net.load_generator(generator)
+    else:
+        gen = pixcaler.net.Generator(in_ch=4, out_ch=4)
+    x = _patches(input_dir, patch_size, n, seed)
+    converters = [
+        ('chainer', ChainerConverter(gen, patch_size * 2)),
+        ('chainer-frozen', ChainerConverter(gen.freeze(), patch_size * 2)),
+        ('onnx', OnnxConverter(export_generator(gen).SerializeToString(), patch_size * 2, threads=threads)),
+    ]
+    results = []
+    ref = None
+    for name, converter in converters:
+        y, seconds = _time(converter, x, batch_size, repeat)
+        if ref is None:
+            ref = y
+        diff = np.abs(y - ref)
+        # difference of the uint8 pixels written to images
+        pixels = np.abs(np.clip(y * 127.5 + 127.5, 0, 255).astype(np.int32) - np.clip(ref * 127.5 + 127.5, 0, 255).astype(np.int32))
+        results.append({
+            'backend': name,
+            'seconds': seconds,
+            'patches_per_second': len(x) / seconds,
+            'max_abs_diff': float(diff.max()),
+            'max_pixel_diff': int(pixels.max()),
+        })
+        print('{backend:<15} {patches_per_second:>8.1f} patches/s  max|diff|={max_abs_diff:.2e} max pixel diff={max_pixel_diff}'.format(**results[-1]))
+    if out is not None:
+        with open(out, 'w') as f:
+            json.dump(results, f, indent=4, sort_keys=True)
+
+if __name__ == '__main__':
+    fire.Fire(main)
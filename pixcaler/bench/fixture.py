@@ -0,0 +1,43 @@
+import shutil
+from pathlib import Path
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+def pixel_art(w, h, seed=0, n_colors=8, scale=2, transparent=True):
+    '''
+    deterministic synthetic pixel-art RGBA image of w x h: random palette
+    rectangles and ellipses drawn at 1/scale and enlarged by nearest neighbor,
+    on a transparent (or opaque palette color) background
+    '''
+    random = np.random.RandomState(seed)
+    palette = [tuple(int(v) for v in random.randint(256, size=3)) + (255,) for _ in range(n_colors)]
+    sw, sh = max(1, w // scale), max(1, h // scale)
+    img = Image.new('RGBA', (sw, sh), (0, 0, 0, 0) if transparent else palette[0])
+    draw = ImageDraw.Draw(img)
+    for _ in range(max(4, sw * sh // 64)):
+        x0, y0 = int(random.randint(sw)), int(random.randint(sh))
+        x1 = min(sw - 1, x0 + int(random.randint(1, max(2, sw // 4))))
+        y1 = min(sh - 1, y0 + int(random.randint(1, max(2, sh // 4))))
+        color = palette[random.randint(1, n_colors)]
+        if random.randint(2):
+            draw.rectangle((x0, y0, x1, y1), fill=color)
+        else:
+            draw.ellipse((x0, y0, x1, y1), fill=color)
+    return img.resize((w, h), Image.NEAREST)
+
+def make_dataset(root, n=8, seed=0, fonts=()):
+    '''
+    write a CompositeAutoUpscaleDataset directory (chartip, obj, tile, font)
+    of n synthetic images each under root and return its path
+    '''
+    root = Path(root)
+    for name in ('chartip', 'obj', 'tile', 'font'):
+        (root/name).mkdir(parents=True, exist_ok=True)
+    for i in range(n):
+        pixel_art(96, 128, seed=seed + i).save(str(root/'chartip'/'{}.png'.format(i)))
+        pixel_art(64, 96, seed=seed + n + i).save(str(root/'obj'/'{}.png'.format(i)))
+        pixel_art(256, 256, seed=seed + 2 * n + i, transparent=False).save(str(root/'tile'/'{}.png'.format(i)))
+    for font in fonts:
+        shutil.copy(str(font), str(root/'font'/Path(font).name))
+    return root
@@ -0,0 +1,82 @@
+import json
+import math
+import time
+from pathlib import Path
+
+import fire
+import numpy as np
+import chainer
+from PIL import Image
+
+import pixcaler.net
+from pixcaler.scaler import ChainerConverter, build_scaler
+
+def _seam_error(img, ref):
+    diff = np.abs(np.asarray(img, dtype=np.int32) - np.asarray(ref, dtype=np.int32))
+    return diff.mean(), diff.max()
+
+def main(
+    generator=None,
+    input_dir='image/dataset/test',
+    mode='up',
+    ratios=(0.5, 0.375, 0.25, 0.125),
+    patch_size=32,
+    batch_size=4,
+    gpu=-1,
+    out=None):
+    '''
+    throughput and error against whole-image (seam-free) conversion of
+    hard-cropped and feathered tiles for each overlap ratio
+    (a randomly initialized Generator is used if generator is omitted)
+    '''
+    if generator is not None:
+        gen = pixcaler.net.load_generator(generator)
+    else:
+        gen = pixcaler.net.Generator(in_ch=4, out_ch=4)
+    if gpu >= 0:
+        chainer.cuda.get_device(gpu).use()
+        gen.to_gpu()
+    converter = ChainerConverter(gen, patch_size * 2)
+
+    imgs = []
+    for path in sorted(Path(input_dir).glob('*.png')):
+        with Image.open(str(path)) as img:
+            imgs.append(img.convert('RGBA'))
+    if not imgs:
+        raise RuntimeError('no png images in {}'.format(input_dir))
+
+    refs = []
+    probe = build_scaler(converter, mode)
+    for img in imgs:
+        size = probe.get_preprocessed_size(*img.size)
+        side = gen.size_unit * math.ceil((max(size) + patch_size * 2) / gen.size_unit)
+        whole = build_scaler(converter, mode, batch_size=1, memory_budget=gen.estimate_memory(side, side, 1))
+        refs.append(whole(img))
+
+    results = []
+    for ratio in ratios:
+        for blend in (False, True):
+            halo = int(round(ratio * patch_size))
+            if blend:
+                scaler = build_scaler(converter, mode, batch_size=batch_size, overlap=ratio)
+            else:
+                scaler = build_scaler(converter, mode, batch_size=batch_size, halo=halo)
+            start = time.perf_counter()
+            converted = [scaler(img) for img in imgs]
+            elapsed = time.perf_counter() - start
+            errors = [_seam_error(img, ref) for img, ref in zip(converted, refs)]
+            results.append({
+                'overlap': ratio,
+                'blend': blend,
+                'seconds': elapsed,
+                'pixels_per_second': sum(img.size[0] * img.size[1] for img in converted) / elapsed,
+                'mean_error': float(np.mean([e[0] for e in errors])),
+                'max_error': int(max(e[1] for e in errors)),
+            })
+            print('overlap={overlap:<6} blend={blend!s:<5} {pixels_per_second:>10.0f} px/s  mean={mean_error:.3f} max={max_error}'.format(**results[-1]))
+    if out is not None:
+        with open(out, 'w') as f:
+            json.dump(results, f, indent=4, sort_keys=True)
+
+if __name__ == '__main__':
+    fire.Fire(main)
@@ -0,0 +1,155 @@
+import json
+import random
+import tempfile
+import time
+from pathlib import Path
+
+import fire
+import numpy as np
+import chainer
+
+import pixcaler.net
+from pixcaler.scaler import MODES, ChainerConverter, build_scaler
+from pixcaler.util import transparent_background
+from pixcaler.bench.fixture import pixel_art, make_dataset
+
+GROUPS = ('scaler', 'dataset', 'updater', 'transparent')
+
+def _list(x):
+    '''
+    fire passes a single value of a list option without the list
+    '''
+    if isinstance(x, str):
+        return x.split(',')
+    if isinstance(x, (list, tuple)):
+        return list(x)
+    return [x]
+
+def _time(fn, repeat, number=1):
+    '''
+    best seconds per operation of fn, which runs number operations, over
+    repeat calls after a warm-up call
+    '''
+    fn()
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, (time.perf_counter() - start) / number)
+    return best
+
+def bench_scaler(sizes, batch_sizes, patch_size, base_ch, seed):
+    gen = pixcaler.net.Generator(in_ch=4, out_ch=4, base_ch=base_ch)
+    converter = ChainerConverter(gen, patch_size * 2)
+    for mode in MODES:
+        for size in sizes:
+            img = pixel_art(size, size, seed=seed)
+            for batch_size in batch_sizes:
+                scaler = build_scaler(converter, mode, batch_size=batch_size)
+                yield 'scaler/{}/{}/b{}'.format(mode, size, batch_size), lambda: scaler(img), 1
+
+def bench_dataset(fonts, seed, number=50):
+    from pixcaler.dataset import CompositeAutoUpscaleDataset
+    if not fonts:
+        print('dataset: skipped (no ttf font; pass --font)')
+        return
+    tmp = tempfile.TemporaryDirectory()
+    # preloaded so that glyph atlases are not rendered while timing
+    dataset = CompositeAutoUpscaleDataset(str(make_dataset(tmp.name, seed=seed, fonts=fonts)), preload=True)
+    def _run():
+        random.seed(seed)
+        np.random.seed(seed)
+        for i in range(number):
+            dataset.get_example(i)
+    try:
+        yield 'dataset/get_example', _run, number
+    finally:
+        tmp.cleanup()
+
+def bench_updater(base_ch, batch_size, seed):
+    from pixcaler.updater import Pix2PixUpdater
+    model = pixcaler.net.Pix2Pix(in_ch=4, out_ch=4, base_ch=base_ch)
+    def make_optimizer(model, alpha=0.0002, beta1=0.5):
+        optimizer = chainer.optimizers.Adam(alpha=alpha, beta1=beta1)
+        optimizer.setup(model)
+        optimizer.add_hook(chainer.optimizer.WeightDecay(0.00001), 'hook_dec')
+        return optimizer
+    x = np.random.RandomState(seed).uniform(-1, 1, (batch_size * 4, 2, 4, 64, 64)).astype('f')
+    updater = Pix2PixUpdater(
+        model=model,
+        iterator={
+            'main': chainer.iterators.SerialIterator([(s, t) for s, t in x], batch_size),
+        },
+        optimizer={
+            'gen': make_optimizer(model.gen),
+            'dis': make_optimizer(model.dis),
+        },
+    )
+    yield 'updater/update_core/b{}'.format(batch_size), updater.update_core, 1
+
+def bench_transparent(size, seed):
+    img = pixel_art(size, size, seed=seed, transparent=False)
+    yield 'transparent_background/{}'.format(size), lambda: transparent_background(img.copy()), 1
+
+def compare(results, baseline, tolerance):
+    '''
+    print the ratio of each result to the same-named baseline result and
+    return the names that are slower by more than tolerance
+    '''
+    with open(baseline) as f:
+        base = {r['name']: r for r in json.load(f)}
+    regressions = []
+    for r in results:
+        if r['name'] not in base:
+            print('{:<36} (not in baseline)'.format(r['name']))
+            continue
+        ratio = r['seconds'] / base[r['name']]['seconds']
+        regressed = ratio > 1 + tolerance
+        if regressed:
+            regressions.append(r['name'])
+        print('{:<36} {:>6.2f}x{}'.format(r['name'], ratio, '  REGRESSION' if regressed else ''))
+    return regressions
+
+def main(
+    only=GROUPS,
+    sizes=(64, 128),
+    batch_sizes=(1, 4),
+    patch_size=32,
+    base_ch=64,
+    train_batch_size=4,
+    transparent_size=256,
+    font=(),
+    repeat=3,
+    seed=0,
+    out=None,
+    baseline=None,
+    tolerance=0.1):
+    '''
+    time the scaling executors, CompositeAutoUpscaleDataset.get_example,
+    Pix2PixUpdater.update_core and transparent_background on deterministic
+    synthetic pixel-art (randomly initialized networks), write the results
+    as JSON to out and compare them with a previous out given as baseline
+    (the dataset benchmark needs ttf fonts; image/dataset/font is used if font is omitted)
+    '''
+    only, sizes, batch_sizes = _list(only), _list(sizes), _list(batch_sizes)
+    fonts = _list(font) or sorted(Path('image/dataset/font').glob('*.ttf'))
+    groups = {
+        'scaler': lambda: bench_scaler(sizes, batch_sizes, patch_size, base_ch, seed),
+        'dataset': lambda: bench_dataset(fonts, seed),
+        'updater': lambda: bench_updater(base_ch, train_batch_size, seed),
+        'transparent': lambda: bench_transparent(transparent_size, seed),
+    }
+    results = []
+    for group in only:
+        for name, fn, number in groups[group]():
+            seconds = _time(fn, repeat, number)
+            results.append({'name': name, 'seconds': seconds})
+            print('{:<36} {:>10.2f} ms'.format(name, seconds * 1000))
+    if out is not None:
+        with open(out, 'w') as f:
+            json.dump(results, f, indent=4, sort_keys=True)
+    if baseline is not None and compare(results, baseline, tolerance):
+        exit(1)
+
+if __name__ == '__main__':
+    fire.Fire(main)
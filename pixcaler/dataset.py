@@ -1,11 +1,14 @@
 import numpy as np
 from pathlib import Path
+import collections
+import multiprocessing
+import os
 import random
 import math
 
 from PIL import Image
-from PIL import ImageFont, ImageDraw
 
+import chainer
 from chainer.dataset import dataset_mixin
 from chainercv.transforms import center_crop
 from chainercv.transforms import random_crop
@@ -15,6 +18,94 @@ from chainercv.transforms import resize
 from chainercv.utils import read_image
 
 from pixcaler.util import img_to_chw_array, downscale_random_nearest_neighbor
+from pixcaler.glyphs import DEFAULT_CACHE, load_drawer
+
+class ReseededDataset(dataset_mixin.DatasetMixin):
+    '''
+    wraps a dataset drawing from the global numpy and random generators;
+    loader processes inherit copies of the same generator states, so each
+    one reseeds them with a seed of its own before its first example
+    '''
+    def __init__(self, dataset, seed=None):
+        self.dataset = dataset
+        self.seed = np.random.randint(2 ** 31) if seed is None else seed
+        self.pid = os.getpid()
+
+    def __len__(self):
+        return len(self.dataset)
+
+    def get_example(self, i):
+        if os.getpid() != self.pid:
+            self.pid = os.getpid()
+            # index of the pool worker (a replaced worker gets a new one)
+            identity = multiprocessing.current_process()._identity
+            worker = identity[-1] if identity else self.pid
+            seed = (self.seed + 1000003 * worker) % 2 ** 32
+            np.random.seed(seed)
+            random.seed(seed)
+        return self.dataset[i]
+
+def make_iterator(dataset, batch_size, loaders=0, **kwargs):
+    '''
+    SerialIterator if loaders is 0, otherwise MultiprocessIterator preparing
+    batches in that many processes (two batches ahead) and handing them over
+    through shared memory
+    '''
+    if loaders <= 0:
+        return chainer.iterators.SerialIterator(dataset, batch_size, **kwargs)
+    return chainer.iterators.MultiprocessIterator(
+        ReseededDataset(dataset), batch_size, n_processes=loaders, n_prefetch=2, **kwargs
+    )
+
+class AssetCache:
+    '''
+    images of paths decoded on first use into (H, W, 4) uint8 arrays,
+    keeping at most max_bytes of them (least recently used are dropped
+    first; None for no limit)
+    '''
+    def __init__(self, paths, max_bytes=None):
+        self.paths = paths
+        self.max_bytes = max_bytes
+        self.arrays = collections.OrderedDict()
+        self.nbytes = 0
+
+    def __len__(self):
+        return len(self.paths)
+
+    def __getitem__(self, i):
+        array = self.arrays.get(i)
+        if array is not None:
+            self.arrays.move_to_end(i)
+            return array
+        with Image.open(str(self.paths[i])) as img:
+            array = np.asarray(img.convert('RGBA'))
+        self.arrays[i] = array
+        self.nbytes += array.nbytes
+        while self.max_bytes is not None and self.nbytes > self.max_bytes:
+            _, dropped = self.arrays.popitem(last=False)
+            self.nbytes -= dropped.nbytes
+        return array
+
+    def preload(self):
+        for i in range(len(self)):
+            self[i]
+
+def random_crop_flip(img, size):
+    '''
+    random_crop to size x size and random_flip(x_random=True) of an
+    (H, W, C) uint8 array as a float CHW array (as img_to_chw_array);
+    draws the same random numbers as the chainercv transforms, and only
+    the crop is converted to float
+    '''
+    H, W = img.shape[:2]
+    if H < size or W < size:
+        raise ValueError('shape of image needs to be larger than output shape')
+    y = random.randint(0, H - size)
+    x = random.randint(0, W - size)
+    img = img[y:y + size, x:x + size]
+    if random.choice([True, False]):
+        img = img[:, ::-1]
+    return img.astype("f").transpose((2, 0, 1)) / 127.5 - 1.0
 
 def random_crop_by_2(img, c_source, pH, pW, fH, fW):
     y = np.random.randint(pH)
@@ -109,14 +200,37 @@ class AutoUpscaleDataset(dataset_mixin.DatasetMixin):
         return source, target
 
 class CompositeAutoUpscaleDataset(dataset_mixin.DatasetMixin):
-    def __init__(self, data_dir, fine_size=64):
+    '''
+    chartip, obj and tile images are decoded once and kept as uint8 arrays
+    up to cache_bytes in total, a third for each kind (None for no limit;
+    each process using the dataset keeps its own); preload decodes all of
+    them up front (without limit), which loader processes then share;
+    text is drawn from glyph atlases of each font and size, which are
+    cached in glyph_cache and loaded on first use (or up front by preload);
+    with Pillow older than 9.1 it is rasterized by ImageDraw instead
+    '''
+    # font sizes of text are drawn from [low, high)
+    font_sizes = (32, 64)
+
+    def __init__(self, data_dir, fine_size=64, cache_bytes=1024 * 2 ** 20, preload=False, glyph_cache=DEFAULT_CACHE):
         import pixcaler.charset
         self.data_dir = Path(data_dir)
-        self.chartips = list((self.data_dir/'chartip').glob("*.png"))
-        self.tiles = list((self.data_dir/'tile').glob("*.png"))
-        self.objs = list((self.data_dir/'obj').glob("*.png"))
+        # split evenly among the chartip, tile and obj caches
+        cache_bytes = None if preload or cache_bytes is None else cache_bytes // 3
+        self.chartips = AssetCache(list((self.data_dir/'chartip').glob("*.png")), cache_bytes)
+        self.tiles = AssetCache(list((self.data_dir/'tile').glob("*.png")), cache_bytes)
+        self.objs = AssetCache(list((self.data_dir/'obj').glob("*.png")), cache_bytes)
+        if preload:
+            for assets in (self.chartips, self.tiles, self.objs):
+                assets.preload()
         self.fonts = list((self.data_dir/'font').glob("*.ttf"))
-        self.charset = list(pixcaler.charset.ALL)
+        self.charset = pixcaler.charset.ALL
+        self.glyph_cache = glyph_cache
+        self.atlases = {}
+        if preload:
+            for font in range(len(self.fonts)):
+                for fontsize in range(*self.font_sizes):
+                    self.atlas(font, fontsize * 3 // 4)
 
         self.fine_size = fine_size
         print("{} chartips loaded".format(len(self.chartips)))
@@ -127,46 +241,43 @@ class CompositeAutoUpscaleDataset(dataset_mixin.DatasetMixin):
     def __len__(self):
         return 10000
 
+    def atlas(self, font, size):
+        key = (font, size)
+        if key not in self.atlases:
+            self.atlases[key] = load_drawer(self.fonts[font], size, self.charset, self.glyph_cache)
+        return self.atlases[key]
+
     # return (source, target)
     def get_example(self, i):
         r = random.random()
         if r < 0.5:
-            with Image.open(str(self.chartips[np.random.randint(len(self.chartips))])) as img:
-                front = img_to_chw_array(img)
+            front = self.chartips[np.random.randint(len(self.chartips))]
         elif r < 0.75:
-            with Image.open(str(self.objs[np.random.randint(len(self.objs))])) as img:
-                front = img_to_chw_array(img)
+            front = self.objs[np.random.randint(len(self.objs))]
         else:
             S = 1
             w, h = self.fine_size * 2 * S, self.fine_size * 2 * S
-            front = Image.new('RGBA', (w, h))
-            draw = ImageDraw.Draw(front)
-            fontsize = np.random.randint(32, 64) * S
-            font = ImageFont.truetype(str(self.fonts[np.random.randint(len(self.fonts))]), fontsize * 3 // 4)
-            txt = ''
-            for i in range(math.ceil(fontsize / h) * 4):
-                txt += ''.join(np.random.choice(self.charset, math.ceil(fontsize / w) * 4))
-                txt += '\n'
+            fontsize = np.random.randint(*self.font_sizes) * S
+            atlas = self.atlas(np.random.randint(len(self.fonts)), fontsize * 3 // 4)
+            # same draws as np.random.choice(self.charset, n) without converting the charset to an array
+            lines = [
+                np.random.randint(len(self.charset), size=math.ceil(fontsize / w) * 4)
+                for i in range(math.ceil(fontsize / h) * 4)
+            ]
             r, g, b = [np.random.randint(256) for i in range(3)]
-            draw.text((0, 0), txt, font=font, fill=(r, g, b, 255))
-            front = img_to_chw_array(front)
-        front = random_crop(front, (self.fine_size, self.fine_size))
-        front = random_flip(front, x_random=True)
+            front = atlas.draw(lines, (w, h), (r, g, b))
+        front = random_crop_flip(front, self.fine_size)
         
         r = random.random()
         if r < 0.9:
-            with Image.open(str(self.tiles[np.random.randint(len(self.tiles))])) as img:
-                back = img_to_chw_array(img)
+            back = self.tiles[np.random.randint(len(self.tiles))]
         elif r < 0.95:
             r, g, b = [np.random.randint(256) for i in range(3)]
-            back = Image.new('RGBA', (self.fine_size, self.fine_size), (r, g, b))
-            back = img_to_chw_array(back)
+            back = np.asarray(Image.new('RGBA', (self.fine_size, self.fine_size), (r, g, b)))
         else:
-            back = Image.new('RGBA', (self.fine_size, self.fine_size), (0, 0, 0, 0))
-            back = img_to_chw_array(back)
+            back = np.asarray(Image.new('RGBA', (self.fine_size, self.fine_size), (0, 0, 0, 0)))
 
-        back = random_crop(back, (self.fine_size, self.fine_size))
-        back = random_flip(back, x_random=True)
+        back = random_crop_flip(back, self.fine_size)
         m = np.tile((front[3,:,:] == 1).reshape((1, self.fine_size, self.fine_size)), (4, 1, 1)).reshape(4 * self.fine_size ** 2)
         back = back.reshape(4 * self.fine_size ** 2)
         back[m] = front.reshape(4 * self.fine_size ** 2)[m]
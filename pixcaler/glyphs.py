@@ -0,0 +1,234 @@
+import hashlib
+import os
+import struct
+import tempfile
+from pathlib import Path
+
+import numpy as np
+import PIL
+from PIL import Image, ImageDraw, ImageFont, features
+
+DEFAULT_CACHE = Path.home()/'.pixcaler'/'glyphs'
+
+# a noncharacter, which no font maps to a glyph
+MISSING = '\U0010ffff'
+
+# ImageDraw.text default spacing between the lines of multiline text
+LINE_SPACING = 4
+
+# GlyphAtlas needs ImageFont.Layout and FreeTypeFont.getlength/getbbox (Pillow 9.1)
+HAS_ATLAS = hasattr(ImageFont, 'Layout') and all(
+    hasattr(ImageFont.FreeTypeFont, name) for name in ('getlength', 'getbbox')
+)
+
+def _div255(x):
+    # rounded x / 255 as Pillow computes it when blending
+    x = x + 128
+    return ((x >> 8) + x) >> 8
+
+def _over(dst, src):
+    '''
+    coverage of src drawn over dst, as Pillow blends glyphs of a line
+    and lines of text
+    '''
+    return src + _div255(dst * (255 - src))
+
+def has_kerning(path):
+    '''
+    whether the font has a kern table, whose pairs FreeType applies in
+    Pillow's basic layout
+    '''
+    with open(str(path), 'rb') as f:
+        head = f.read(12)
+        offset = 0
+        if head[:4] == b'ttcf':
+            f.seek(12)
+            offset, = struct.unpack('>I', f.read(4))
+            f.seek(offset)
+            head = f.read(12)
+        n_tables, = struct.unpack('>H', head[4:6])
+        f.seek(offset + 12)
+        records = f.read(16 * n_tables)
+    return any(records[16 * i:16 * i + 4] == b'kern' for i in range(n_tables))
+
+def _same_glyph(a, b):
+    return a[1:] == b[1:] and (
+        a[0] is None and b[0] is None
+        or a[0] is not None and b[0] is not None and a[0].shape == b[0].shape and (a[0] == b[0]).all()
+    )
+
+def _digest(path, chars):
+    h = hashlib.sha1()
+    with open(str(path), 'rb') as f:
+        h.update(f.read())
+    h.update(chars.encode('utf-8'))
+    h.update('{} {}'.format(PIL.__version__, features.version('freetype2')).encode('utf-8'))
+    return h.hexdigest()[:16]
+
+class GlyphAtlas:
+    '''
+    coverage masks of chars rendered by a font at a size, packed in one
+    array, with the positions and advances of Pillow's basic layout, so
+    that text is drawn by blitting the masks instead of rasterizing it
+    (raqm shaping, if Pillow has it, is not reproduced)
+    '''
+    def __init__(self, path, size, chars, masks, glyphs, line_spacing):
+        self.path = path
+        self.size = size
+        self.chars = chars
+        self.masks = masks
+        # (start in masks, height, width, x, y, advance in 1/64 pixels, kerned) of each char
+        self.glyphs = glyphs.tolist()
+        self.line_spacing = line_spacing
+        self.font = None
+        self.pairs = {}
+
+    @classmethod
+    def render(cls, path, size, chars):
+        font = ImageFont.truetype(str(path), size, layout_engine=ImageFont.Layout.BASIC)
+        def rasterize(c):
+            advance = int(round(font.getlength(c) * 64))
+            x0, y0, x1, y1 = font.getbbox(c)
+            if x1 <= x0 or y1 <= y0:
+                return None, 0, 0, advance
+            img = Image.new('L', (x1 - x0, y1 - y0))
+            ImageDraw.Draw(img).text((-x0, -y0), c, font=font, fill=255)
+            mask = np.asarray(img)
+            rows = np.flatnonzero(mask.any(axis=1))
+            cols = np.flatnonzero(mask.any(axis=0))
+            if len(rows) == 0:
+                return None, 0, 0, advance
+            mask = mask[rows[0]:rows[-1] + 1, cols[0]:cols[-1] + 1]
+            return mask, x0 + cols[0], y0 + rows[0], advance
+        # chars missing from the font are drawn as its notdef glyph, which is never kerned
+        notdef = rasterize(MISSING)
+        kerning = has_kerning(path)
+        masks = []
+        # identical masks (notdef in particular) are stored once
+        starts = {}
+        glyphs = np.zeros((len(chars), 7), dtype=np.int64)
+        n = 0
+        for i, c in enumerate(chars):
+            mask, x, y, advance = glyph = rasterize(c)
+            kerned = kerning and not _same_glyph(glyph, notdef)
+            if mask is None:
+                glyphs[i] = (0, 0, 0, 0, 0, advance, kerned)
+                continue
+            key = (mask.shape, mask.tobytes())
+            if key not in starts:
+                starts[key] = n
+                masks.append(mask.ravel())
+                n += mask.size
+            glyphs[i] = (starts[key], mask.shape[0], mask.shape[1], x, y, advance, kerned)
+        masks = np.concatenate(masks) if masks else np.zeros(0, dtype=np.uint8)
+        line_spacing = font.getbbox('A')[3] + LINE_SPACING
+        return cls(path, size, chars, masks, glyphs, line_spacing)
+
+    @classmethod
+    def load(cls, path, size, chars, cache_dir=DEFAULT_CACHE):
+        '''
+        the atlas saved in cache_dir, rendered and saved there first if
+        there is none for this font file, size, chars and Pillow/FreeType
+        '''
+        path = Path(path)
+        cache = Path(cache_dir)/'{}-{}-{}.npz'.format(path.stem, size, _digest(path, chars))
+        if cache.exists():
+            with np.load(str(cache)) as f:
+                return cls(
+                    path, size, chars, f['masks'], f['glyphs'], int(f['line_spacing']),
+                )
+        atlas = cls.render(path, size, chars)
+        cache.parent.mkdir(parents=True, exist_ok=True)
+        # written under another name first, as loader processes may render the same atlas
+        fd, tmp = tempfile.mkstemp(suffix='.npz', dir=str(cache.parent))
+        with os.fdopen(fd, 'wb') as f:
+            np.savez(
+                f, masks=atlas.masks, glyphs=np.array(atlas.glyphs, dtype=np.int64),
+                line_spacing=atlas.line_spacing,
+            )
+        os.replace(tmp, str(cache))
+        return atlas
+
+    def kern(self, a, b):
+        '''
+        kerning in 1/64 pixels between the chars of indices a and b
+        '''
+        if not (self.glyphs[a][6] and self.glyphs[b][6]):
+            return 0
+        k = self.pairs.get((a, b))
+        if k is None:
+            if self.font is None:
+                self.font = ImageFont.truetype(str(self.path), self.size, layout_engine=ImageFont.Layout.BASIC)
+            pair = self.chars[a] + self.chars[b]
+            k = int(round(self.font.getlength(pair) * 64)) - self.glyphs[a][5] - self.glyphs[b][5]
+            if len(self.pairs) >= 2 ** 16:
+                self.pairs.clear()
+            self.pairs[a, b] = k
+        return k
+
+    def draw(self, lines, size, color):
+        '''
+        (h, w, 4) uint8 array of lines (sequences of char indices) drawn
+        from the top left with color on a transparent w x h image, as
+        ImageDraw.text draws the lines joined by newlines
+        '''
+        w, h = size
+        alpha = np.zeros((h, w), dtype=np.int32)
+        for k, line in enumerate(lines):
+            top = k * self.line_spacing
+            pen = 0
+            placed = []
+            prev = None
+            for i in line:
+                if prev is not None:
+                    pen += self.kern(prev, i)
+                start, gh, gw, gx, gy, advance, _ = self.glyphs[i]
+                if gh:
+                    placed.append((start, gh, gw, ((pen + 32) & -64) // 64 + gx, top + gy))
+                pen += advance
+                prev = i
+            if not placed:
+                continue
+            x0 = min(p[3] for p in placed)
+            y0 = min(p[4] for p in placed)
+            x1 = max(p[3] + p[2] for p in placed)
+            y1 = max(p[4] + p[1] for p in placed)
+            if x1 <= 0 or y1 <= 0 or x0 >= w or y0 >= h:
+                continue
+            band = np.zeros((y1 - y0, x1 - x0), dtype=np.int32)
+            for start, gh, gw, x, y in placed:
+                mask = self.masks[start:start + gh * gw].reshape((gh, gw))
+                region = band[y - y0:y - y0 + gh, x - x0:x - x0 + gw]
+                region[...] = _over(region, mask.astype(np.int32))
+            cx0, cy0 = max(x0, 0), max(y0, 0)
+            cx1, cy1 = min(x1, w), min(y1, h)
+            region = alpha[cy0:cy1, cx0:cx1]
+            region[...] = _over(region, band[cy0 - y0:cy1 - y0, cx0 - x0:cx1 - x0])
+        out = np.zeros((h, w, 4), dtype=np.uint8)
+        out[..., 3] = alpha
+        out[alpha > 0, :3] = color
+        return out
+
+class TextDrawer:
+    '''
+    draws text like GlyphAtlas.draw by rasterizing it with ImageDraw.text
+    each time, where Pillow is too old for GlyphAtlas
+    '''
+    def __init__(self, path, size, chars):
+        self.font = ImageFont.truetype(str(path), size)
+        self.chars = chars
+
+    def draw(self, lines, size, color):
+        img = Image.new('RGBA', size)
+        txt = ''.join(''.join(self.chars[i] for i in line) + '\n' for line in lines)
+        ImageDraw.Draw(img).text((0, 0), txt, font=self.font, fill=tuple(color) + (255,))
+        return np.asarray(img)
+
+def load_drawer(path, size, chars, cache_dir=DEFAULT_CACHE):
+    '''
+    GlyphAtlas.load(path, size, chars, cache_dir), or a TextDrawer of the
+    font if Pillow is older than 9.1
+    '''
+    if HAS_ATLAS:
+        return GlyphAtlas.load(path, size, chars, cache_dir)
+    return TextDrawer(path, size, chars)
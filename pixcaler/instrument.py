@@ -0,0 +1,123 @@
+import collections
+import contextlib
+import sys
+import threading
+import time
+import tracemalloc
+
+# stages reported to on_stage(name, seconds) of conversion event handlers, in pipeline order
+STAGES = ('load', 'resize', 'pad', 'align', 'extract', 'forward', 'stitch', 'crop', 'save')
+
+@contextlib.contextmanager
+def timed(handler, name):
+    '''
+    report the wall-clock duration of the block to handler.on_stage(name, seconds)
+    and, while tracemalloc is tracing, the peak bytes it allocated on top of
+    what was allocated before and the absolute traced peak during the block to
+    handler.on_memory(name, added, peak). The traced peak is reset for each
+    block, so these are per block, not per run; it is process wide, so blocks
+    must not be timed on several threads at once while tracing. Before
+    Python 3.9 the traced peak cannot be reset, so memory is only reported
+    for blocks that raise the peak traced so far
+    '''
+    tracing = tracemalloc.is_tracing()
+    if tracing:
+        base, previous_peak = tracemalloc.get_traced_memory()
+        if hasattr(tracemalloc, 'reset_peak'):
+            tracemalloc.reset_peak()
+            previous_peak = None
+    start = time.perf_counter()
+    yield
+    handler.on_stage(name, time.perf_counter() - start)
+    if tracing:
+        peak = tracemalloc.get_traced_memory()[1]
+        if previous_peak is None or peak > previous_peak:
+            handler.on_memory(name, peak - base, peak)
+
+def max_rss():
+    '''
+    peak resident set size in bytes of this process and of its largest
+    terminated child, or None where the resource module is unavailable
+    '''
+    try:
+        import resource
+    except ImportError:
+        return None
+    # ru_maxrss is in KiB on Linux and in bytes on macOS
+    unit = 1 if sys.platform == 'darwin' else 1024
+    return (
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * unit,
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * unit,
+    )
+
+class StageProfiler:
+    '''
+    aggregates stage durations and image totals of conversion events
+    (thread safe, as stages may be reported from pipeline threads)
+    '''
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.seconds = collections.Counter()
+        self.calls = collections.Counter()
+        self.totals = collections.Counter()
+        # largest on_memory reports of each stage
+        self.added = {}
+        self.peak = {}
+        self.start = time.perf_counter()
+
+    def on_patch(self, patch, idx, n):
+        pass
+
+    def on_stage(self, name, seconds, calls=1):
+        with self.lock:
+            self.seconds[name] += seconds
+            self.calls[name] += calls
+
+    def on_memory(self, name, added, peak):
+        with self.lock:
+            self.added[name] = max(added, self.added.get(name, 0))
+            self.peak[name] = max(peak, self.peak.get(name, 0))
+
+    def on_image(self, stats):
+        with self.lock:
+            self.totals.update(stats)
+            self.totals['images'] += 1
+
+    def table(self):
+        '''
+        summary of the time spent in each stage and of the images converted
+        '''
+        wall = time.perf_counter() - self.start
+        total = sum(self.seconds.values())
+        names = [name for name in STAGES if name in self.seconds] + sorted(set(self.seconds) - set(STAGES))
+        memory = bool(self.peak)
+        header = '{:<10} {:>8} {:>10} {:>12} {:>7}'.format('stage', 'calls', 'total [s]', 'per call [ms]', 'share')
+        if memory:
+            header += ' {:>13} {:>11}'.format('+peak [MiB]', 'peak [MiB]')
+        lines = [header]
+        for name in names:
+            line = '{:<10} {:>8} {:>10.3f} {:>12.3f} {:>6.1f}%'.format(
+                name,
+                self.calls[name],
+                self.seconds[name],
+                self.seconds[name] / self.calls[name] * 1000,
+                self.seconds[name] / total * 100,
+            )
+            if memory and name in self.peak:
+                line += ' {:>13.1f} {:>11.1f}'.format(self.added[name] / 2 ** 20, self.peak[name] / 2 ** 20)
+            lines.append(line)
+        lines.append('{images} images, {pixels} pixels, {patches} patches ({converted} converted, {cached} cached, {skipped} skipped) in {batches} batches'.format(
+            **dict(dict.fromkeys(('images', 'pixels', 'patches', 'converted', 'cached', 'skipped', 'batches'), 0), **self.totals)
+        ))
+        lines.append('{:.3f}s wall clock, {:.3f}s in stages (stages of pipeline threads and workers overlap)'.format(wall, total))
+        if memory:
+            lines.append('largest stage peak {:.1f} MiB (+peak: allocated by the stage, peak: all traced memory during it)'.format(
+                max(self.peak.values()) / 2 ** 20,
+            ))
+        rss = max_rss()
+        if rss is not None:
+            line = 'max RSS {:.1f} MiB'.format(rss[0] / 2 ** 20)
+            if rss[1]:
+                line += ' (largest child process {:.1f} MiB)'.format(rss[1] / 2 ** 20)
+            lines.append(line)
+        return '\n'.join(lines)
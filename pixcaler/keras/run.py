@@ -26,6 +26,9 @@ class KerasConverter(pixcaler.scaler.Converter):
     def get_input_size(self):
         return self.input_size
 
+    def convert_array(self, x):
+        return self.gen.predict(x.transpose((0, 2, 3, 1))).transpose((0, 3, 1, 2))
+
     def __call__(self, imgs):
         x_in = np.asarray([pixcaler.util.img_to_hwc_array(img) for img in imgs])
         x_out = self.gen.predict(x_in)
@@ -171,6 +174,7 @@ class Pix2Pix(object):
         out_dir='result/',
         generator=None,
         discriminator=None,
+        loaders=0,
     ):
         if generator is not None:
             self.gen.load_weights(generator)
@@ -184,9 +188,10 @@ class Pix2Pix(object):
         train_dataset = pixcaler.dataset.CompositeAutoUpscaleDataset(str(dataset_dir))
         test_dataset = pixcaler.dataset.CompositeAutoUpscaleDataset(str(dataset_dir))
         
-        train_iterator = chainer.iterators.SerialIterator(
+        train_iterator = pixcaler.dataset.make_iterator(
             train_dataset,
-            batch_size=batch_size,
+            batch_size,
+            loaders,
         )
         test_iterator = chainer.iterators.SerialIterator(
             test_dataset,
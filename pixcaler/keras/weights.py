@@ -0,0 +1,70 @@
+import numpy as np
+import keras
+
+import pixcaler.net
+
+# Keras kernels are (kh, kw, in, out) for Conv2D and (kh, kw, out, in) for
+# Conv2DTranspose; Chainer weights are (out, in, kh, kw) for Convolution2D
+# and (in, out, kh, kw) for Deconvolution2D, so both map by transposing
+# (2, 3, 1, 0) without flipping. 'same' padding of the generator's kernels
+# is symmetric and equals the Chainer pads.
+KERNEL_AXES = (2, 3, 1, 0)
+
+def chainer_layers(gen):
+    '''
+    [(conv, batchnorm or None)] of a Generator in the order the Keras
+    generator creates its layers
+    '''
+    return (
+        [(gen.enc.c0, None)] +
+        [(gen.enc['c{}'.format(i)].c, gen.enc['c{}'.format(i)].batchnorm) for i in range(1, 8)] +
+        [(gen.dec['c{}'.format(i)].c, gen.dec['c{}'.format(i)].batchnorm) for i in range(0, 7)] +
+        [(gen.dec.c7, None)]
+    )
+
+def keras_layers(model):
+    '''
+    (convolutions, batch normalizations) of a pixcaler.keras.model generator, in order
+    '''
+    # Conv2DTranspose is a subclass of Conv2D
+    convs = [l for l in model.layers if isinstance(l, keras.layers.Conv2D)]
+    bns = [l for l in model.layers if isinstance(l, keras.layers.BatchNormalization)]
+    return convs, bns
+
+def _check(model, gen):
+    convs, bns = keras_layers(model)
+    pairs = chainer_layers(gen)
+    n_bn = sum(bn is not None for _, bn in pairs)
+    if len(convs) != len(pairs) or len(bns) != n_bn:
+        raise ValueError('layers do not match: {} / {} convolutions, {} / {} batch normalizations'.format(
+            len(convs), len(pairs), len(bns), n_bn,
+        ))
+    return zip(convs, pairs), iter(bns)
+
+def to_keras(gen, model):
+    '''
+    copy the weights of a Generator (on CPU) into a Keras generator
+    '''
+    if isinstance(gen, pixcaler.net.FrozenGenerator):
+        raise ValueError('frozen generators have no batch normalization statistics; convert the original npz')
+    convs, bns = _check(model, gen)
+    for conv, (c, bn) in convs:
+        conv.set_weights([c.W.data.transpose(KERNEL_AXES), c.b.data])
+        if bn is not None:
+            next(bns).set_weights([bn.gamma.data, bn.beta.data, bn.avg_mean, bn.avg_var])
+
+def from_keras(model, gen):
+    '''
+    copy the weights of a Keras generator into a Generator (on CPU)
+    '''
+    convs, bns = _check(model, gen)
+    for conv, (c, bn) in convs:
+        W, b = conv.get_weights()
+        c.W.data[...] = W.transpose(np.argsort(KERNEL_AXES))
+        c.b.data[...] = b
+        if bn is not None:
+            gamma, beta, mean, var = next(bns).get_weights()
+            bn.gamma.data[...] = gamma
+            bn.beta.data[...] = beta
+            bn.avg_mean[...] = mean
+            bn.avg_var[...] = var
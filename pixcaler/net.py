@@ -122,16 +122,66 @@ class Decoder(chainer.Chain):
                 h = self.c7(h)
         return h
 
+def estimate_generator_memory(h, w, batch_size=1, in_ch=4, out_ch=4, base_ch=64):
+    '''
+    rough peak bytes of float32 buffers (weights, activations and im2col
+    columns) allocated by Generator inference on a (batch_size, in_ch, h, w) input
+    '''
+    b = base_ch
+    def px(scale):
+        return batch_size * (h // scale) * (w // scale)
+    # (input ch, input scale, output ch, output scale, kernel size)
+    enc = [
+        (in_ch, 1, b, 1, 5),
+        (b, 1, b * 2, 1, 3),
+        (b * 2, 1, b * 4, 2, 4),
+        (b * 4, 2, b * 8, 4, 4),
+    ] + [(b * 8, 2 ** i, b * 8, 2 ** (i + 1), 4) for i in range(2, 6)]
+    dec = [
+        (b * 8, 64, b * 8, 32, 4),
+        (b * 16, 32, b * 8, 16, 4),
+        (b * 16, 16, b * 8, 8, 4),
+        (b * 16, 8, b * 8, 4, 4),
+        (b * 16, 4, b * 4, 2, 4),
+        (b * 8, 2, b * 2, 1, 4),
+        (b * 4, 1, b, 1, 3),
+        (b * 2, 1, out_ch, 1, 5),
+    ]
+    def col(c_in, f_in, c_out, f_out, k):
+        if f_out < f_in:
+            # deconvolution: columns are computed on the input grid
+            return c_out * k * k * px(f_in)
+        return c_in * k * k * px(f_out)
+    weights = sum(c_in * c_out * k * k for c_in, _, c_out, _, k in enc + dec)
+    # skip connections are kept alive until the decoder consumes them
+    skips = sum(c_out * px(f_out) for _, _, c_out, f_out, _ in enc)
+    # input, im2col buffer (twice, as tensordot copies it into matrix layout)
+    # and conv/batchnorm/activation outputs of a single layer
+    transient = max(
+        c_in * px(f_in) + 2 * col(c_in, f_in, c_out, f_out, k) + 3 * c_out * px(f_out)
+        for c_in, f_in, c_out, f_out, k in enc + dec
+    )
+    return 4 * (weights + skips + transient)
+
 class Generator(chainer.Chain):
+    # spatial size of inputs must be a multiple of this (6 stride-2 convolutions)
+    size_unit = 64
+
     def __init__(self, in_ch, out_ch, base_ch=64):        
         super().__init__(
             enc=Encoder(in_ch, base_ch),
             dec=Decoder(out_ch, base_ch),
         )
+        self.in_ch = in_ch
+        self.out_ch = out_ch
+        self.base_ch = base_ch
 
     def __call__(self, x_in):
         return self.dec(self.enc(x_in))
 
+    def estimate_memory(self, h, w, batch_size=1):
+        return estimate_generator_memory(h, w, batch_size, self.in_ch, self.out_ch, self.base_ch)
+
     def fix_broken_batchnorm(self):
         '''
         add-hook fix for broken batch normalization
@@ -146,6 +196,120 @@ class Generator(chainer.Chain):
             if xp.isnan(cbr.batchnorm.avg_var[-1]):
                 cbr.batchnorm.avg_var = xp.zeros(cbr.batchnorm.avg_var.shape, cbr.batchnorm.avg_var.dtype)        
 
+    def freeze(self):
+        '''
+        FrozenGenerator computing the same as this generator in inference mode
+        '''
+        self.fix_broken_batchnorm()
+        frozen = FrozenGenerator(self.in_ch, self.out_ch, self.base_ch)
+        if self.xp is not numpy:
+            frozen.to_gpu()
+        layers = (
+            [self.enc.c0] + [self.enc['c{}'.format(i)] for i in range(1, 8)] +
+            [self.dec['c{}'.format(i)] for i in range(0, 7)] + [self.dec.c7]
+        )
+        for dst, src in zip(frozen.layers(), layers):
+            if isinstance(src, CBR):
+                W, b = _fold_batchnorm(src.c, src.batchnorm)
+            else:
+                W, b = src.W.data, src.b.data
+            dst.W.data[...] = W
+            dst.b.data[...] = b
+        return frozen
+
+def _fold_batchnorm(conv, bn):
+    '''
+    weight and bias of conv followed by bn in inference mode
+    '''
+    xp = cuda.get_array_module(conv.W.data)
+    scale = bn.gamma.data.astype('d') / xp.sqrt(bn.avg_var.astype('d') + bn.eps)
+    shape = [1] * conv.W.ndim
+    # W is (out, in, kh, kw) for convolutions and (in, out, kh, kw) for deconvolutions
+    shape[1 if isinstance(conv, L.Deconvolution2D) else 0] = -1
+    W = conv.W.data * scale.reshape(shape)
+    b = (conv.b.data - bn.avg_mean) * scale + bn.beta.data
+    return W.astype(conv.W.dtype), b.astype(conv.b.dtype)
+
+class FrozenGenerator(chainer.Chain):
+    '''
+    inference-only Generator: batch normalization is folded into the
+    convolutions and dropout is removed. made by Generator.freeze()
+    '''
+    size_unit = 64
+
+    def __init__(self, in_ch, out_ch, base_ch=64):
+        b = base_ch
+        layers = {}
+        layers['e0'] = L.Convolution2D(in_ch, b, 5, 1, 2)
+        layers['e1'] = L.Convolution2D(b, b * 2, 3, 1, 1)
+        layers['e2'] = L.Convolution2D(b * 2, b * 4, 4, 2, 1)
+        layers['e3'] = L.Convolution2D(b * 4, b * 8, 4, 2, 1)
+        for i in range(4, 8):
+            layers['e{}'.format(i)] = L.Convolution2D(b * 8, b * 8, 4, 2, 1)
+        layers['d0'] = L.Deconvolution2D(b * 8, b * 8, 4, 2, 1)
+        for i in range(1, 4):
+            layers['d{}'.format(i)] = L.Deconvolution2D(b * 16, b * 8, 4, 2, 1)
+        layers['d4'] = L.Deconvolution2D(b * 16, b * 4, 4, 2, 1)
+        layers['d5'] = L.Deconvolution2D(b * 8, b * 2, 4, 2, 1)
+        layers['d6'] = L.Convolution2D(b * 4, b, 3, 1, 1)
+        layers['d7'] = L.Convolution2D(b * 2, out_ch, 5, 1, 2)
+        super().__init__(**layers)
+        self.in_ch = in_ch
+        self.out_ch = out_ch
+        self.base_ch = base_ch
+
+    @staticmethod
+    def layer_names():
+        return ['e{}'.format(i) for i in range(8)] + ['d{}'.format(i) for i in range(8)]
+
+    def layers(self):
+        return [self[name] for name in self.layer_names()]
+
+    def __call__(self, x_in):
+        h = x_in
+        hs = []
+        for i in range(8):
+            h = F.leaky_relu(self['e{}'.format(i)](h))
+            hs.append(h)
+        h = F.relu(self.d0(hs[-1]))
+        for i in range(1, 8):
+            h = self['d{}'.format(i)](F.concat([h, hs[-i - 1]]))
+            if i < 7:
+                h = F.relu(h)
+        return h
+
+    def estimate_memory(self, h, w, batch_size=1):
+        return estimate_generator_memory(h, w, batch_size, self.in_ch, self.out_ch, self.base_ch)
+
+    def fix_broken_batchnorm(self):
+        pass
+
+    def freeze(self):
+        '''
+        this generator, which is frozen already
+        '''
+        return self
+
+def load_generator(path):
+    '''
+    Generator or FrozenGenerator (detected from its keys) stored by
+    save_npz, or by pixcaler.quantize.save_quantized, at path, with broken
+    batch normalization fixed
+    '''
+    with numpy.load(str(path)) as f:
+        if 'e0/W_q' in f.files:
+            from pixcaler.quantize import load_quantized
+            return load_quantized(path)
+        frozen = 'e0/W' in f.files
+        W_in = f['e0/W' if frozen else 'enc/c0/W'].shape
+        W_out = f['d7/W' if frozen else 'dec/c7/W'].shape
+    base_ch, in_ch = W_in[:2]
+    out_ch = W_out[0]
+    gen = (FrozenGenerator if frozen else Generator)(in_ch, out_ch, base_ch)
+    chainer.serializers.load_npz(str(path), gen)
+    gen.fix_broken_batchnorm()
+    return gen
+
 class Discriminator(chainer.Chain):
     def __init__(self, in_ch, out_ch, flat=True, base_ch=64):
         assert base_ch % 2 == 0
@@ -0,0 +1,130 @@
+import os
+import tempfile
+
+import numpy as np
+import chainer.links as L
+
+from pixcaler.net import estimate_generator_memory
+from pixcaler.scaler import Converter
+from pixcaler.util import img_to_chw_array, chw_array_to_img
+
+# onnx and onnxruntime are only needed by this module and are imported lazily
+
+def _layer_arrays(layer):
+    '''
+    (W, b, stride, pad, deconv) of a FrozenGenerator layer in float32
+    '''
+    W, b = layer.W.data, layer.b.data
+    deconv = isinstance(layer, L.Deconvolution2D)
+    return np.asarray(W, dtype=np.float32), np.asarray(b, dtype=np.float32), layer.stride, layer.pad, deconv
+
+def export_generator(gen, opset=13):
+    '''
+    ONNX model of gen (Generator or FrozenGenerator on CPU) with input 'x'
+    and output 'y' of shape (batch, channel, height, width), batch, height
+    and width being dynamic
+    '''
+    from onnx import helper, numpy_helper, TensorProto
+
+    gen = gen.freeze()
+    nodes = []
+    initializers = []
+    def _conv(name, x, layer):
+        W, b, stride, pad, deconv = _layer_arrays(layer)
+        initializers.append(numpy_helper.from_array(W, name + '/W'))
+        initializers.append(numpy_helper.from_array(b, name + '/b'))
+        nodes.append(helper.make_node(
+            'ConvTranspose' if deconv else 'Conv',
+            [x, name + '/W', name + '/b'], [name],
+            kernel_shape=list(W.shape[2:]), strides=list(stride), pads=list(pad) * 2,
+        ))
+        return name
+    def _activation(op, x, **kwargs):
+        nodes.append(helper.make_node(op, [x], [x + '/' + op], **kwargs))
+        return x + '/' + op
+
+    h = 'x'
+    hs = []
+    for i in range(8):
+        h = _activation('LeakyRelu', _conv('e{}'.format(i), h, gen['e{}'.format(i)]), alpha=0.2)
+        hs.append(h)
+    h = _activation('Relu', _conv('d0', h, gen.d0))
+    for i in range(1, 8):
+        concat = 'd{}/concat'.format(i)
+        nodes.append(helper.make_node('Concat', [h, hs[-i - 1]], [concat], axis=1))
+        h = _conv('d{}'.format(i), concat, gen['d{}'.format(i)])
+        if i < 7:
+            h = _activation('Relu', h)
+    nodes.append(helper.make_node('Identity', [h], ['y']))
+
+    graph = helper.make_graph(
+        nodes, 'pixcaler-generator',
+        [helper.make_tensor_value_info('x', TensorProto.FLOAT, ['batch', gen.in_ch, 'height', 'width'])],
+        [helper.make_tensor_value_info('y', TensorProto.FLOAT, ['batch', gen.out_ch, 'height', 'width'])],
+        initializers,
+    )
+    model = helper.make_model(graph, opset_imports=[helper.make_opsetid('', opset)], producer_name='pixcaler')
+    helper.set_model_props(model, {
+        'in_ch': str(gen.in_ch),
+        'out_ch': str(gen.out_ch),
+        'base_ch': str(gen.base_ch),
+        'size_unit': str(gen.size_unit),
+    })
+    return model
+
+def quantize_model(model):
+    '''
+    serialized ONNX model of model (path or serialized bytes of a model made
+    by export_generator) computing its convolutions in int8: onnxruntime's
+    dynamic quantization stores the Conv weights as uint8 and runs them as
+    ConvInteger on activations quantized at each call (ConvTranspose stays
+    float32)
+    '''
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    with tempfile.TemporaryDirectory() as tmp:
+        src = os.path.join(tmp, 'float32.onnx')
+        dst = os.path.join(tmp, 'int8.onnx')
+        if isinstance(model, bytes):
+            with open(src, 'wb') as f:
+                f.write(model)
+        else:
+            src = str(model)
+        # the CPU ConvInteger kernel takes uint8 weights only
+        quantize_dynamic(src, dst, op_types_to_quantize=['Conv'], weight_type=QuantType.QUInt8)
+        with open(dst, 'rb') as f:
+            return f.read()
+
+class OnnxConverter(Converter):
+    '''
+    runs an exported generator with onnxruntime. model is the path or the
+    serialized bytes of an ONNX model made by export_generator
+    '''
+    def __init__(self, model, input_size, threads=None, providers=('CPUExecutionProvider',)):
+        import onnxruntime
+        options = onnxruntime.SessionOptions()
+        if threads is not None:
+            options.intra_op_num_threads = threads
+        if not isinstance(model, bytes):
+            model = str(model)
+        self.session = onnxruntime.InferenceSession(model, options, providers=list(providers))
+        self.props = self.session.get_modelmeta().custom_metadata_map
+        self.input_size = input_size
+
+    def get_input_size(self):
+        return self.input_size
+
+    def get_size_unit(self):
+        return int(self.props['size_unit'])
+
+    def estimate_memory(self, h, w, batch_size):
+        return estimate_generator_memory(
+            h, w, batch_size, int(self.props['in_ch']), int(self.props['out_ch']), int(self.props['base_ch']),
+        )
+
+    def convert_array(self, x):
+        return self.session.run(['y'], {'x': np.asarray(x, dtype=np.float32)})[0]
+
+    def __call__(self, imgs):
+        x = np.asarray([img_to_chw_array(img) for img in imgs])
+        return [chw_array_to_img(x) for x in self.convert_array(x)]
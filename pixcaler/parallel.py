@@ -0,0 +1,123 @@
+import ctypes
+import multiprocessing
+import os
+import pickle
+
+import numpy as np
+
+# environment variables read by the BLAS / OpenMP runtimes when numpy is imported
+THREAD_ENV = ('OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS')
+
+def _arrays(link):
+    for path, l in link.namedlinks():
+        for name in sorted(l._params):
+            yield path + '/' + name, l, name, getattr(l, name).array
+        for name in sorted(l._persistent):
+            value = getattr(l, name)
+            if isinstance(value, np.ndarray):
+                yield path + '/' + name, l, name, value
+
+def _rebind(l, name, array):
+    if name in l._params:
+        getattr(l, name).array = array
+    else:
+        setattr(l, name, array)
+
+def share_arrays(link):
+    '''
+    move the parameters and persistent arrays of a CPU link into shared
+    memory; returns {name: (buffer, shape, dtype)} to pass to attach_arrays
+    '''
+    shared = {}
+    for key, l, name, array in _arrays(link):
+        buf = multiprocessing.RawArray(ctypes.c_char, max(array.nbytes, 1))
+        view = np.frombuffer(buf, dtype=array.dtype, count=array.size).reshape(array.shape)
+        view[...] = array
+        _rebind(l, name, view)
+        shared[key] = (buf, array.shape, array.dtype.str)
+    return shared
+
+def attach_arrays(link, shared):
+    '''
+    make the arrays of link views of the buffers made by share_arrays
+    '''
+    links = dict(link.namedlinks())
+    for key, (buf, shape, dtype) in shared.items():
+        path, name = key.rsplit('/', 1)
+        dtype = np.dtype(dtype)
+        view = np.frombuffer(buf, dtype=dtype, count=int(np.prod(shape))).reshape(shape)
+        _rebind(links[path], name, view)
+
+def skeleton(link):
+    '''
+    pickled link without its parameters, gradients and persistent arrays,
+    from which workers rebuild it around the shared arrays
+    '''
+    arrays = list(_arrays(link))
+    grads = [(l, name, getattr(l, name).grad) for _, l, name, _ in arrays if name in l._params]
+    for _, l, name, _ in arrays:
+        _rebind(l, name, None)
+    for l, name, _ in grads:
+        getattr(l, name).grad = None
+    try:
+        return pickle.dumps(link)
+    finally:
+        for _, l, name, array in arrays:
+            _rebind(l, name, array)
+        for l, name, grad in grads:
+            getattr(l, name).grad = grad
+
+_worker = None
+
+def _init(link, shared, setup, setup_args):
+    global _worker
+    link = pickle.loads(link)
+    attach_arrays(link, shared)
+    _worker = setup(link, *setup_args)
+
+def _call(task):
+    fn, args = task
+    return fn(_worker, *args)
+
+class SharedModelPool:
+    '''
+    process pool whose workers share the weights of one CPU link.
+    each worker unpickles the link without its arrays, attaches it to the
+    shared arrays and keeps setup(link, *setup_args) as the state passed
+    to tasks; threads limits the BLAS / OpenMP threads of each worker
+    '''
+    def __init__(self, link, processes, setup, setup_args=(), threads=None):
+        shared = share_arrays(link)
+        pickled = skeleton(link)
+        ctx = multiprocessing.get_context('spawn')
+        saved = {name: os.environ.get(name) for name in THREAD_ENV}
+        if threads is not None:
+            for name in THREAD_ENV:
+                os.environ[name] = str(threads)
+        try:
+            self.pool = ctx.Pool(processes, _init, (pickled, shared, setup, setup_args))
+        finally:
+            for name, value in saved.items():
+                if value is None:
+                    os.environ.pop(name, None)
+                else:
+                    os.environ[name] = value
+
+    def imap_unordered(self, fn, tasks):
+        '''
+        fn(state, *args) for each args in tasks, in order of completion
+        '''
+        return self.pool.imap_unordered(_call, ((fn, tuple(args)) for args in tasks))
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        if exc[0] is None:
+            self.close()
+        else:
+            self.pool.terminate()
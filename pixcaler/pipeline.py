@@ -0,0 +1,74 @@
+import queue
+import threading
+
+_END = object()
+
+class _Failure:
+    def __init__(self, error):
+        self.error = error
+
+def prefetch(iterable, maxsize=4):
+    '''
+    iterate `iterable` on a background thread, keeping at most maxsize
+    items ready; exceptions are re-raised in the consuming thread
+    '''
+    q = queue.Queue(maxsize)
+    def _run():
+        try:
+            for item in iterable:
+                q.put(item)
+        except Exception as e:
+            q.put(_Failure(e))
+        else:
+            q.put(_END)
+    thread = threading.Thread(target=_run, daemon=True)
+    thread.start()
+    while True:
+        item = q.get()
+        if item is _END:
+            break
+        if isinstance(item, _Failure):
+            raise item.error
+        yield item
+    thread.join()
+
+class BackgroundWorker:
+    '''
+    runs submitted calls in order on a background thread; submit() blocks
+    while maxsize calls are waiting, and close() re-raises the first error
+    '''
+    def __init__(self, maxsize=4):
+        self.queue = queue.Queue(maxsize)
+        self.error = None
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is _END:
+                break
+            fn, args = item
+            if self.error is not None:
+                continue
+            try:
+                fn(*args)
+            except Exception as e:
+                self.error = e
+
+    def submit(self, fn, *args):
+        if self.error is not None:
+            raise self.error
+        self.queue.put((fn, args))
+
+    def close(self):
+        self.queue.put(_END)
+        self.thread.join()
+        if self.error is not None:
+            raise self.error
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
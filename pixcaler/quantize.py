@@ -0,0 +1,96 @@
+import numpy
+
+from chainer import cuda
+import chainer.links as L
+
+from pixcaler.net import FrozenGenerator
+
+PRECISIONS = ('float32', 'float16', 'int8')
+
+def quantize_weight(W, deconv, precision):
+    '''
+    (W_q, W_scale) storing the weight W of a convolution or deconvolution
+    at precision: float32 or float16 (W_scale is None), or int8 with a
+    float32 scale per output channel
+    '''
+    W = cuda.to_cpu(W)
+    if precision in ('float32', 'float16'):
+        return W.astype(precision), None
+    if precision == 'int8':
+        # W is (out, in, kh, kw) for convolutions and (in, out, kh, kw) for deconvolutions
+        axis = 1 if deconv else 0
+        scale = numpy.abs(W).max(axis=tuple(i for i in range(W.ndim) if i != axis), keepdims=True) / 127
+        scale[scale == 0] = 1
+        return numpy.rint(W / scale).astype(numpy.int8), scale.astype(numpy.float32)
+    raise ValueError('unknown precision {}'.format(precision))
+
+def dequantize_weight(W_q, W_scale):
+    W = W_q.astype(numpy.float32)
+    if W_scale is not None:
+        W *= W_scale
+    return W
+
+def _quantized_layers(gen, precision):
+    '''
+    (name, W_q, W_scale, b) of each layer of the FrozenGenerator of gen
+    '''
+    for name, layer in zip(gen.layer_names(), gen.layers()):
+        W_q, W_scale = quantize_weight(layer.W.data, isinstance(layer, L.Deconvolution2D), precision)
+        yield name, W_q, W_scale, cuda.to_cpu(layer.b.data)
+
+def quantize(gen, precision):
+    '''
+    FrozenGenerator of gen (Generator or FrozenGenerator) with its weights
+    rounded to precision, one of PRECISIONS, as save_quantized stores them.
+    The weights are expanded back to float32 here, so it computes at
+    float32 speed
+    '''
+    if precision not in PRECISIONS:
+        raise ValueError('unknown precision {}'.format(precision))
+    gen = gen.freeze()
+    if precision == 'float32':
+        return gen
+    rounded = FrozenGenerator(gen.in_ch, gen.out_ch, gen.base_ch)
+    if gen.xp is not numpy:
+        rounded.to_gpu()
+    for (name, W_q, W_scale, b), layer in zip(_quantized_layers(gen, precision), rounded.layers()):
+        layer.W.data[...] = rounded.xp.asarray(dequantize_weight(W_q, W_scale))
+        layer.b.data[...] = rounded.xp.asarray(b)
+    return rounded
+
+def save_quantized(gen, path, precision):
+    '''
+    save the weights of the FrozenGenerator of gen at precision;
+    load_generator reads them back as quantize(gen, precision)
+    '''
+    arrays = {}
+    for name, W_q, W_scale, b in _quantized_layers(gen.freeze(), precision):
+        arrays[name + '/W_q'] = W_q
+        if W_scale is not None:
+            arrays[name + '/W_scale'] = W_scale
+        arrays[name + '/b'] = b
+    with open(str(path), 'wb') as f:
+        numpy.savez_compressed(f, **arrays)
+
+def load_quantized(path):
+    '''
+    FrozenGenerator of the weights saved by save_quantized, expanded to float32
+    '''
+    with numpy.load(str(path)) as f:
+        W_in = f['e0/W_q'].shape
+        W_out = f['d7/W_q'].shape
+        gen = FrozenGenerator(W_in[1], W_out[0], W_in[0])
+        for name, layer in zip(gen.layer_names(), gen.layers()):
+            W_scale = f[name + '/W_scale'] if name + '/W_scale' in f.files else None
+            layer.W.data[...] = dequantize_weight(f[name + '/W_q'], W_scale)
+            layer.b.data[...] = f[name + '/b']
+    return gen
+
+def stored_bytes(gen, precision):
+    '''
+    bytes of the weights of gen stored at precision (uncompressed)
+    '''
+    return sum(
+        W_q.nbytes + b.nbytes + (0 if W_scale is None else W_scale.nbytes)
+        for _, W_q, W_scale, b in _quantized_layers(gen.freeze(), precision)
+    )
@@ -0,0 +1,60 @@
+import numpy as np
+
+from pixcaler.util import chw_array_to_hwc_uint8
+
+
+def measure_edge_error(converter, xs, tile_size=None, context=None, n_windows=8, seed=0):
+    '''
+    effective receptive field of converter measured at tile edges.
+
+    For random windows of the CHW arrays xs, a tile_size tile is converted
+    alone and again with `context` extra pixels on each side; everything
+    outside the tile is the perturbation. Returns an array whose d-th
+    element is the max difference (in 8-bit levels) over output pixels at
+    distance d from the nearest tile edge.
+    '''
+    unit = converter.get_size_unit()
+    if unit is None:
+        raise ValueError('receptive field analysis requires a converter accepting arbitrary input sizes')
+    s = converter.get_input_size() if tile_size is None else tile_size
+    context = s if context is None else context
+    big = s + 2 * context
+    if s % unit != 0 or big % unit != 0:
+        raise ValueError('tile_size and tile_size + 2 * context must be multiples of {}'.format(unit))
+
+    rng = np.random.RandomState(seed)
+    distance = np.minimum(
+        np.minimum.outer(np.arange(s), np.arange(s)),
+        np.minimum.outer(np.arange(s)[::-1], np.arange(s)[::-1]),
+    )
+    errors = np.zeros(s // 2, dtype=np.int32)
+    for x in xs:
+        C, H, W = x.shape
+        if H < big or W < big:
+            raise ValueError('input {}x{} is smaller than {}x{}'.format(W, H, big, big))
+        for _ in range(n_windows):
+            top = rng.randint(H - big + 1)
+            left = rng.randint(W - big + 1)
+            window = x[:, top:top + big, left:left + big]
+            tile = window[:, context:context + s, context:context + s]
+            ref = converter.convert_array(np.asarray([window]))[0][:, context:context + s, context:context + s]
+            out = converter.convert_array(np.asarray([tile]))[0]
+            diff = np.abs(
+                chw_array_to_hwc_uint8(ref).astype(np.int32) - chw_array_to_hwc_uint8(out).astype(np.int32)
+            ).max(axis=2)
+            np.maximum.at(errors, distance.ravel(), diff.ravel())
+    return errors
+
+def minimal_halo(edge_error, tolerance=0, step=1):
+    '''
+    smallest halo (a multiple of step) such that no output pixel that far
+    or farther from a tile edge differs by more than tolerance
+    '''
+    worst = np.maximum.accumulate(edge_error[::-1])[::-1]
+    for halo in range(0, len(worst), step):
+        if worst[halo] <= tolerance:
+            return halo
+    return None
+
+def find_minimal_halo(converter, xs, tolerance=0, step=2, **kwargs):
+    return minimal_halo(measure_edge_error(converter, xs, **kwargs), tolerance, step)
@@ -0,0 +1,92 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from pathlib import Path
+
+
+def file_hash(path):
+    h = hashlib.sha1()
+    with open(str(path), 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+def code_version():
+    '''
+    hash of the pixcaler sources, so that results of older code are not reused
+    '''
+    h = hashlib.sha1()
+    for path in sorted(Path(__file__).parent.glob('*.py')):
+        h.update(path.name.encode('utf-8'))
+        h.update(path.read_bytes())
+    return h.hexdigest()
+
+class ResultCache:
+    '''
+    directory of converted images keyed by everything that affects the
+    output; least recently used files are evicted beyond max_bytes
+    '''
+    def __init__(self, directory, max_bytes=None, suffix='.png'):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.suffix = suffix
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def key(self, **parts):
+        return hashlib.sha1(json.dumps(parts, sort_keys=True).encode('utf-8')).hexdigest()
+
+    def _path(self, key):
+        return self.directory/(key + self.suffix)
+
+    def get(self, key):
+        '''
+        path of the stored result or None
+        '''
+        path = self._path(key)
+        if not path.exists():
+            self.misses += 1
+            return None
+        self.hits += 1
+        os.utime(str(path))
+        return path
+
+    def put(self, key, path):
+        fd, tmp = tempfile.mkstemp(suffix=self.suffix, dir=str(self.directory), prefix='.')
+        os.close(fd)
+        shutil.copyfile(str(path), tmp)
+        os.replace(tmp, str(self._path(key)))
+        self.evict()
+
+    def entries(self):
+        return [
+            (path, path.stat())
+            for path in self.directory.glob('*' + self.suffix)
+            if not path.name.startswith('.')
+        ]
+
+    def evict(self):
+        if self.max_bytes is None:
+            return
+        entries = sorted(self.entries(), key=lambda e: e[1].st_mtime)
+        total = sum(st.st_size for _, st in entries)
+        for path, st in entries:
+            if total <= self.max_bytes:
+                break
+            path.unlink()
+            total -= st.st_size
+            self.evictions += 1
+
+    def stats(self):
+        entries = self.entries()
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'entries': len(entries),
+            'bytes': sum(st.st_size for _, st in entries),
+        }
@@ -1,12 +1,104 @@
 import argparse
+import collections
+import contextlib
+import os
+import shutil
+import threading
+import tracemalloc
 from PIL import Image
 from pathlib import Path
 
+import numpy as np
 import chainer
-from pixcaler.net import Generator
-from pixcaler.scaler import Upscaler, Downscaler, ChainerConverter, Refiner
+from pixcaler.net import load_generator
+from pixcaler.quantize import PRECISIONS, quantize
+from pixcaler.scaler import MODES, ChainerConverter, PatchCache, build_scaler
+from pixcaler.util import png_save_options
+from pixcaler.result_cache import ResultCache, file_hash, code_version
+from pixcaler.pipeline import prefetch, BackgroundWorker
+from pixcaler.parallel import SharedModelPool
+from pixcaler.onnx_backend import OnnxConverter, export_generator, quantize_model
+from pixcaler.stream import PngStreamWriter, NpyStreamWriter, open_rgba
+from pixcaler.instrument import StageProfiler, timed
+from pixcaler.autotune import DEFAULT_PROFILE, load_profile, profile_key
 
 
+def load_image(path):
+    '''
+    PIL image of a png (or any PIL readable) or (H, W, 4) uint8 .npy file
+    '''
+    if Path(path).suffix == '.npy':
+        return Image.fromarray(np.asarray(open_rgba(path)))
+    with Image.open(path) as img:
+        return img.convert('RGBA')
+
+def open_source(path):
+    '''
+    HWC uint8 RGBA array of path for streaming; .npy files are memory-mapped
+    '''
+    if Path(path).suffix == '.npy':
+        return open_rgba(path)
+    with Image.open(path) as img:
+        return np.asarray(img.convert('RGBA'))
+
+def save_compare_image(scaler, image_path, img, converted_img, compare_dir, save_options):
+    compare_path = compare_dir/(image_path.stem + '.png')
+    compareable_image = scaler.generate_comparable_image(img)
+    w_comp, h_comp = compareable_image.size
+    w_conv, h_conv = converted_img.size
+    w_gen = w_comp + w_conv
+    h_gen = max(h_comp, h_conv)
+    compare_img = Image.new('RGBA', (w_gen, h_gen))
+    compare_img.paste(compareable_image, (0, 0))
+    compare_img.paste(converted_img, (w_comp, 0))
+    compare_img.save(compare_path, **save_options)
+    print(image_path, '->', compare_path)
+
+class _StatsRecorder:
+    def __init__(self):
+        # name: [seconds, calls, added bytes, peak bytes]
+        self.stages = {}
+    def on_patch(self, patch, idx, n):
+        pass
+    def _stage(self, name):
+        return self.stages.setdefault(name, [0.0, 0, None, None])
+    def on_stage(self, name, seconds):
+        stage = self._stage(name)
+        stage[0] += seconds
+        stage[1] += 1
+    def on_memory(self, name, added, peak):
+        stage = self._stage(name)
+        stage[2] = max(added, stage[2] or 0)
+        stage[3] = max(peak, stage[3] or 0)
+    def on_image(self, stats):
+        self.stats = stats
+
+def _setup_worker(gen, config):
+    if config['trace_memory']:
+        tracemalloc.start()
+    handler = _StatsRecorder()
+    cache = PatchCache(config['patch_cache']) if config['patch_cache'] > 0 else None
+    converter = ChainerConverter(gen, input_size=config['patch_size'] * 2)
+    scaler = build_scaler(converter, config['mode'], handler=handler, cache=cache, **config['scaler_options'])
+    return dict(config, scaler=scaler, handler=handler)
+
+def convert_file(worker, image_path, single_path):
+    '''
+    task of --workers mode: convert and save one image, returning its
+    stats and the seconds, calls and peak memory of each stage
+    '''
+    handler = worker['handler']
+    handler.stages = {}
+    with timed(handler, 'load'):
+        img = load_image(image_path)
+    scaler = worker['scaler']
+    converted_img = scaler(img)
+    with timed(handler, 'save'):
+        converted_img.save(single_path, **worker['save_options'])
+    if worker['compare_dir'] is not None:
+        save_compare_image(scaler, image_path, img, converted_img, worker['compare_dir'], worker['save_options'])
+    return image_path, single_path, handler.stats, handler.stages
+
 def main():
     parser = argparse.ArgumentParser(description='chainer implementation of pix2pix')
     parser.add_argument(
@@ -15,7 +107,7 @@ def main():
     )
     parser.add_argument(
         '--input_dir', '-i', type=str,
-        help='directory containing input images (all png images in the directory are converted)'
+        help='directory containing input images (all png and npy images in the directory are converted)'
     )
     parser.add_argument(
         '--gpu', '-g', type=int, default=-1,
@@ -30,33 +122,159 @@ def main():
         help='output images for compare',
     )
     parser.add_argument(
-        '--patch_size', '-p', type=int, default=32,
+        '--patch_size', '-p', type=int, default=None,
+        help='size of the kept core of each tile (default: from --autotune_profile, or 32)',
+    )
+    parser.add_argument(
+        '--batch_size', '-b', type=int, default=None,
+        help='tiles per converter call (default: from --autotune_profile, or 4)',
+    )
+    parser.add_argument(
+        '--autotune_profile', type=str, default=str(DEFAULT_PROFILE),
+        help='profile written by `python -m pixcaler.autotune` for the defaults of --patch_size and --batch_size',
+    )
+    parser.add_argument(
+        '--halo', type=int, default=None,
+        help='context pixels around each tile (default: patch_size // 2)',
+    )
+    parser.add_argument(
+        '--tile_memory', type=int, default=None,
+        help='run tiles as large as fit in this many MiB instead of patch_size * 2 (fully convolutional)',
+    )
+    parser.add_argument(
+        '--patch_cache', type=int, default=0,
+        help='number of converted patches to keep for reuse on identical input patches (0 to disable)',
+    )
+    parser.add_argument(
+        '--skip_uniform', type=str, choices=('copy', 'lut'), default=None,
+        help='do not run the network on single-color patches: copy them, or convert once per color (lut)',
+    )
+    parser.add_argument(
+        '--cache_dir', type=str, default=None,
+        help='directory to keep converted images in and reuse them for unchanged inputs',
+    )
+    parser.add_argument(
+        '--cache_size', type=int, default=1024,
+        help='maximum size of --cache_dir in MiB (least recently used results are evicted)',
+    )
+    parser.add_argument(
+        '--cache_stats', action='store_true', default=False,
+        help='print --cache_dir statistics at the end',
+    )
+    parser.add_argument(
+        '--pipeline', action='store_true', default=False,
+        help='decode and encode images on background threads while converting',
+    )
+    parser.add_argument(
+        '--queue_size', type=int, default=4,
+        help='number of images decoded ahead / waiting to be encoded in --pipeline mode',
+    )
+    parser.add_argument(
+        '--compress_level', type=int, choices=range(10), default=None,
+        help='PNG compression level of output images (0: fastest, 9: smallest)',
+    )
+    parser.add_argument(
+        '--output_format', type=str, choices=('png', 'npy'), default='png',
+        help='format of output images; npy writes (H, W, 4) uint8 arrays through a memmap (implies --stream)',
     )
     parser.add_argument(
-        '--batch_size', '-b', type=int, default=4,
+        '--stream', action='store_true', default=False,
+        help='convert and write images band by band to bound memory use on very large images',
+    )
+    parser.add_argument(
+        '--workers', type=int, default=1,
+        help='number of CPU worker processes sharing one copy of the model (images are dispatched largest first)',
+    )
+    parser.add_argument(
+        '--threads_per_worker', type=int, default=None,
+        help='BLAS / OpenMP threads of each --workers process (default: cores // workers), or onnxruntime threads',
+    )
+    parser.add_argument(
+        '--profile', action='store_true', default=False,
+        help='print the time spent in each stage of the conversion at the end',
+    )
+    parser.add_argument(
+        '--profile_memory', action='store_true', default=False,
+        help='also trace the peak memory allocated in each stage (per stage, not per run; '
+             'implies --profile; slower; not with --pipeline)',
+    )
+    parser.add_argument(
+        '--memory_limit', type=int, default=None,
+        help='MiB the estimated peak of converting an image may take (shared by --workers): '
+             'the batch size is reduced to fit and images that do not fit at batch size 1 are skipped',
     )
     parser.add_argument(
         '--generator', type=str, required=True,
         help='path to generator model',
     )
     parser.add_argument(
-        '--mode', type=str, choices=('up', 'down', 'refine'), default='up',
+        '--backend', type=str, choices=('chainer', 'onnx'), default='chainer',
+        help='inference runtime; onnx accepts a .onnx --generator or exports the npz one on the fly',
+    )
+    parser.add_argument(
+        '--freeze', action='store_true', default=False,
+        help='fold batch normalization into the convolutions before converting (faster on CPU)',
+    )
+    parser.add_argument(
+        '--precision', type=str, choices=PRECISIONS, default='float32',
+        help='with --backend chainer, round the weights to this precision (implies --freeze) to preview '
+             'generators saved by pixcaler.tool.freeze-generator --precision; computation stays float32, '
+             'so it is not faster. with --backend onnx, int8 runs the convolutions in int8 by onnxruntime '
+             'dynamic quantization (faster on CPU) and float16 only rounds the weights',
+    )
+    parser.add_argument(
+        '--mode', type=str, choices=MODES, default='up',
         help='scaling mode',
     )
     
     args = parser.parse_args()
+    if args.workers > 1 and args.gpu >= 0:
+        parser.error('--workers is only supported on CPU')
+    if args.backend == 'onnx' and (args.workers > 1 or args.gpu >= 0):
+        parser.error('--backend onnx runs on CPU in a single process (use --threads_per_worker for its threads)')
+    args.stream = args.stream or args.output_format == 'npy'
+    if args.stream and (args.compare or args.pipeline or args.workers > 1):
+        parser.error('--stream and npy output cannot be combined with --compare, --pipeline or --workers')
+    if args.profile_memory and args.pipeline:
+        # the traced peak is process wide, so the stages of the pipeline threads would reset each other's
+        parser.error('--profile_memory cannot be combined with --pipeline')
+    tuned = load_profile(args.autotune_profile).get(profile_key(args.backend, args.gpu), {})
+    if tuned and (args.patch_size is None or args.batch_size is None):
+        print('autotuned: {} (--patch_size {} --batch_size {})'.format(
+            args.autotune_profile, tuned['patch_size'], tuned['batch_size'],
+        ))
+    if args.patch_size is None:
+        args.patch_size = tuned.get('patch_size', 32)
+    if args.batch_size is None:
+        args.batch_size = tuned.get('batch_size', 4)
+    args.profile = args.profile or args.profile_memory
+    if args.profile_memory:
+        tracemalloc.start()
     gen_path = Path(args.generator)
     print('GPU: {}'.format(args.gpu))
     print('')
 
-    gen = Generator(in_ch=4, out_ch=4)
-    
-    if args.gpu >= 0:
-        chainer.cuda.get_device(args.gpu).use()
-        gen.to_gpu()
-
-    chainer.serializers.load_npz(gen_path, gen)
-    gen.fix_broken_batchnorm()
+    frozen = args.freeze or args.precision != 'float32'
+    # onnxruntime quantizes the float32 weights itself
+    onnx_int8 = args.backend == 'onnx' and args.precision == 'int8'
+    if args.backend == 'onnx' and gen_path.suffix == '.onnx':
+        gen = None
+        model = gen_path
+    else:
+        gen = load_generator(gen_path)
+        if frozen:
+            gen = quantize(gen, 'float32' if onnx_int8 else args.precision)
+        if args.backend == 'onnx':
+            model = export_generator(gen).SerializeToString()
+    if args.backend == 'onnx':
+        if onnx_int8:
+            model = quantize_model(model)
+        converter = OnnxConverter(model, args.patch_size * 2, threads=args.threads_per_worker)
+    else:
+        if args.gpu >= 0:
+            chainer.cuda.get_device(args.gpu).use()
+            gen.to_gpu()
+        converter = ChainerConverter(gen, input_size=args.patch_size * 2)
 
     out_dir = Path(args.out)
     if args.compare:
@@ -69,46 +287,224 @@ def main():
         single_dir.mkdir(parents=True, exist_ok=True)
 
     class Logger:
-        def __init__(self, context=""):
-            self.context = context
+        def __init__(self, profiler):
+            # images being converted, oldest first
+            self.contexts = collections.deque()
+            self.profiler = profiler
         def on_patch(self, patch, idx, n):
-            print("{}: {}/{}".format(self.context, idx + 1, n), end='\r')
-    converter = ChainerConverter(gen, input_size=args.patch_size * 2)
-    logger = Logger()
-
-    if args.mode == 'up':
-        scaler = Upscaler(converter, batch_size=args.batch_size, handler=logger)
-    elif args.mode == 'down':
-        scaler = Downscaler(converter, batch_size=args.batch_size, handler=logger)
-    elif args.mode == 'refine':
-        scaler = Refiner(converter, batch_size=args.batch_size, handler=logger)    
-    else:
-        raise RuntimeError("unknown mode: {}".format(args.mode))
+            print("{}: {}/{}".format(self.contexts[0], idx + 1, n), end='\r')
+        def on_stage(self, name, seconds, calls=1):
+            if self.profiler is not None:
+                self.profiler.on_stage(name, seconds, calls)
+        def on_memory(self, name, added, peak):
+            if self.profiler is not None:
+                self.profiler.on_memory(name, added, peak)
+        def on_image(self, stats):
+            if self.profiler is not None:
+                self.profiler.on_image(stats)
+            print("{}: {} patches ({} converted, {} cached, {} skipped)".format(
+                self.contexts.popleft(),
+                stats['patches'],
+                stats['converted'],
+                stats['cached'],
+                stats['skipped'],
+            ))
+    profiler = StageProfiler() if args.profile else None
+    logger = Logger(profiler)
+    cache = PatchCache(args.patch_cache) if args.patch_cache > 0 else None
+    scaler_options = dict(
+        batch_size=args.batch_size,
+        halo=args.halo,
+        memory_budget=None if args.tile_memory is None else args.tile_memory * 2 ** 20,
+        skip_uniform=args.skip_uniform,
+    )
+    scaler = build_scaler(converter, args.mode, handler=logger, cache=cache, **scaler_options)
 
     if args.input_dir is not None:
-        image_paths = Path(args.input_dir).glob('*.png')
+        image_paths = [path for path in Path(args.input_dir).iterdir() if path.suffix in ('.png', '.npy')]
     else:
         image_paths = [Path(image_path_str) for image_path_str in args.images]        
-    for image_path in image_paths:
-        logger.context = str(image_path)
-        single_path = single_dir/image_path.name
-        with Image.open(image_path) as img:
-            img = img.convert('RGBA')
-            converted_img = scaler(img)
-            converted_img.save(single_path)
+
+    def _size(image_path):
+        if image_path.suffix == '.npy':
+            h, w = open_rgba(image_path).shape[:2]
+        else:
+            with Image.open(image_path) as img:
+                w, h = img.size
+        return w, h
+
+    if args.memory_limit is not None:
+        limit = args.memory_limit * 2 ** 20 // args.workers
+        candidates = [
+            build_scaler(converter, args.mode, **dict(scaler_options, batch_size=batch_size))
+            for batch_size in range(args.batch_size, 0, -1)
+        ]
+        batch_size = args.batch_size
+        fitting = []
+        for image_path in image_paths:
+            w, h = _size(image_path)
+            fits = [c for c in candidates if c.estimate_peak_memory(w, h, stream=args.stream) <= limit]
+            if not fits:
+                print('{}: skipped, needs about {:.0f} MiB at batch size 1 (try --stream or --tile_memory)'.format(
+                    image_path, candidates[-1].estimate_peak_memory(w, h, stream=args.stream) / 2 ** 20,
+                ))
+                continue
+            batch_size = min(batch_size, fits[0].executor.batch_size)
+            fitting.append(image_path)
+        image_paths = fitting
+        if batch_size < args.batch_size:
+            print('batch size reduced to {} to fit --memory_limit'.format(batch_size))
+            scaler_options['batch_size'] = batch_size
+            scaler = build_scaler(converter, args.mode, handler=logger, cache=cache, **scaler_options)
+    if args.cache_dir is not None:
+        result_cache = ResultCache(args.cache_dir, max_bytes=args.cache_size * 2 ** 20, suffix='.' + args.output_format)
+        # tiles are sized from --tile_memory and the batch size (which --memory_limit
+        # may reduce), so the resolved tile size and halo are part of the key
+        result_options = dict(
+            generator=file_hash(gen_path),
+            freeze=frozen,
+            backend=args.backend,
+            precision=args.precision,
+            mode=args.mode,
+            patch_size=args.patch_size,
+            halo=scaler.executor.halo,
+            tile_size=scaler.executor.max_input_size,
+            skip_uniform=args.skip_uniform,
+            code=code_version(),
+        )
+    else:
+        result_cache = None
+    save_options = png_save_options(args.compress_level)
+    # guards result_cache when its files are read and written from different threads
+    result_cache_lock = threading.Lock()
+
+    def _save_compare_image(image_path, img, converted_img):
+        save_compare_image(scaler, image_path, img, converted_img, compare_dir, save_options)
+
+    def _lookup(image_path):
+        '''
+        copy the cached result of image_path to the output if there is one;
+        returns (single_path, result_key, hit)
+        '''
+        single_path = single_dir/(image_path.stem + '.' + args.output_format)
+        if result_cache is None:
+            return single_path, None, False
+        result_key = result_cache.key(input=file_hash(image_path), **result_options)
+        with result_cache_lock:
+            cached_path = result_cache.get(result_key)
+            if cached_path is not None:
+                shutil.copyfile(str(cached_path), str(single_path))
+        if cached_path is None:
+            return single_path, result_key, False
+        print(image_path, '->', single_path, '(cached)')
+        if args.compare:
+            img = load_image(image_path)
+            with Image.open(single_path) as f:
+                _save_compare_image(image_path, img, f.convert('RGBA'))
+        return single_path, result_key, True
+
+    # images handed to the scaler, in order
+    converting = collections.deque()
+    def _inputs():
+        for image_path in image_paths:
+            single_path, result_key, hit = _lookup(image_path)
+            if hit:
+                continue
+            with timed(logger, 'load'):
+                img = load_image(image_path)
+            logger.contexts.append(str(image_path))
+            converting.append((image_path, single_path, result_key, img))
+            yield img
+
+    def _save(image_path, single_path, result_key, img, converted_img):
+        with timed(logger, 'save'):
+            converted_img.save(single_path, **save_options)
+        if result_cache is not None:
+            with result_cache_lock:
+                result_cache.put(result_key, single_path)
+        print(image_path, '->', single_path)
+        if args.compare:
+            _save_compare_image(image_path, img, converted_img)
+
+    def _area(image_path):
+        w, h = _size(image_path)
+        return w * h
+
+    if args.workers > 1:
+        result_keys = {}
+        for image_path in image_paths:
+            single_path, result_key, hit = _lookup(image_path)
+            if not hit:
+                result_keys[image_path] = (single_path, result_key)
+        # largest first, so that no worker is left alone with a large image at the end
+        tasks = sorted(result_keys, key=_area, reverse=True)
+        threads = args.threads_per_worker or max(1, (os.cpu_count() or 1) // args.workers)
+        config = dict(
+            mode=args.mode,
+            patch_size=args.patch_size,
+            patch_cache=args.patch_cache,
+            scaler_options=scaler_options,
+            compare_dir=compare_dir if args.compare else None,
+            save_options=save_options,
+            trace_memory=args.profile_memory,
+        )
+        with SharedModelPool(gen, args.workers, _setup_worker, (config,), threads) as pool:
+            tasks = pool.imap_unordered(convert_file, ((path, result_keys[path][0]) for path in tasks))
+            for image_path, single_path, stats, stages in tasks:
+                if result_cache is not None:
+                    result_cache.put(result_keys[image_path][1], single_path)
+                for name, (seconds, calls, added, peak) in stages.items():
+                    logger.on_stage(name, seconds, calls)
+                    if peak is not None:
+                        logger.on_memory(name, added, peak)
+                logger.contexts.append(str(image_path))
+                logger.on_image(stats)
+                print(image_path, '->', single_path)
+    elif args.stream:
+        for image_path in image_paths:
+            single_path, result_key, hit = _lookup(image_path)
+            if hit:
+                continue
+            with timed(logger, 'load'):
+                src = open_source(image_path)
+            w, h = scaler.get_output_size(src.shape[1], src.shape[0])
+            logger.contexts.append(str(image_path))
+            if args.output_format == 'npy':
+                writer = NpyStreamWriter(single_path, w, h)
+            else:
+                writer = PngStreamWriter(single_path, w, h, save_options.get('compress_level', 6))
+            with writer:
+                scaler.stream(src, writer.write)
+            if result_cache is not None:
+                result_cache.put(result_key, single_path)
             print(image_path, '->', single_path)
-            if args.compare:
-                compare_path = compare_dir/image_path.name
-                compareable_image = scaler.generate_comparable_image(img)
-                w_comp, h_comp = compareable_image.size
-                w_conv, h_conv = converted_img.size
-                w_gen = w_comp + w_conv
-                h_gen = max(h_comp, h_conv)
-                compare_img = Image.new('RGBA', (w_gen, h_gen))
-                compare_img.paste(compareable_image, (0, 0))
-                compare_img.paste(converted_img, (w_comp, 0))
-                compare_img.save(compare_path)
-                print(image_path, '->', compare_path)
+    else:
+        if args.pipeline:
+            inputs = prefetch(_inputs(), args.queue_size)
+            writer = BackgroundWorker(args.queue_size)
+        else:
+            inputs = _inputs()
+            writer = None
+        with writer if writer is not None else contextlib.ExitStack():
+            for converted_img in scaler.map(inputs):
+                job = converting.popleft() + (converted_img,)
+                if writer is not None:
+                    writer.submit(_save, *job)
+                else:
+                    _save(*job)
+    if cache is not None and args.workers <= 1:
+        print('patch cache: {} hits, {} misses, {} entries'.format(cache.hits, cache.misses, len(cache)))
+    if result_cache is not None and args.cache_stats:
+        print('result cache: {hits} hits, {misses} misses, {evictions} evictions, {entries} entries, {bytes} bytes'.format(
+            **result_cache.stats()
+        ))
+    if profiler is not None:
+        print(profiler.table())
+        if image_paths:
+            w, h = max((_size(image_path) for image_path in image_paths), key=lambda size: size[0] * size[1])
+            print('estimated peak of the largest image ({}x{}): {:.1f} MiB'.format(
+                w, h, scaler.estimate_peak_memory(w, h, stream=args.stream) / 2 ** 20,
+            ))
         
 
 if __name__ == '__main__':
@@ -1,20 +1,62 @@
+import collections
+import hashlib
+import itertools
+import math
+
 from PIL import Image
 import numpy as np
 
 import chainer
-from pixcaler.util import chw_array_to_img, img_to_chw_array, align_2x_nearest_neighbor_scaled_image, pad_by_multiply_of, chunks
+from pixcaler.instrument import timed
+from pixcaler.util import chw_array_to_img, chw_array_to_hwc_uint8, img_to_chw_array, align_2x_nearest_neighbor_scaled_image, pad_by_multiply_of, extract_patches, nearest_index, reflect_index
 
 
 class NullConversionEventHandler:
     def on_patch(self, patch, idx, n):
         pass
 
+    def on_stage(self, name, seconds):
+        pass
+
+    def on_memory(self, name, added, peak):
+        pass
+
+    def on_image(self, stats):
+        pass
+
+_converter_identities = itertools.count()
+
 class Converter:
+    def get_identity(self):
+        '''
+        token unique to this converter within the process (used by PatchCache)
+        '''
+        if not hasattr(self, '_identity'):
+            self._identity = next(_converter_identities)
+        return self._identity
+
     def get_input_size(self):
-        raise NotImplemented()        
+        raise NotImplementedError()
 
-    def __call__(self, img):
-        raise NotImplemented()
+    def get_size_unit(self):
+        '''
+        None if only get_input_size() is accepted, otherwise any multiple of this is accepted
+        '''
+        return None
+
+    def estimate_memory(self, h, w, batch_size):
+        raise NotImplementedError()
+
+    def __call__(self, imgs):
+        raise NotImplementedError()
+
+    def convert_array(self, x):
+        '''
+        convert NCHW float array in [-1, 1] and return NCHW float array on CPU
+        '''
+        return np.asarray([
+            img_to_chw_array(img) for img in self([chw_array_to_img(c) for c in x])
+        ])
 
 class ChainerConverter(Converter):
     def __init__(self, gen, input_size):
@@ -24,114 +66,563 @@ class ChainerConverter(Converter):
     def get_input_size(self):
         return self.input_size
 
-    def __call__(self, imgs):
+    def get_size_unit(self):
+        return self.gen.size_unit
+
+    def estimate_memory(self, h, w, batch_size):
+        return self.gen.estimate_memory(h, w, batch_size)
+
+    def convert_array(self, x):
         xp = self.gen.xp
         self.gen.fix_broken_batchnorm()
-        
-        x = xp.asarray([img_to_chw_array(img) for img in imgs])
-        x_in = chainer.Variable(x)
+
+        x_in = chainer.Variable(xp.asarray(x))
         with chainer.using_config('train', False), chainer.using_config('enable_back_prop', False):
             x_out = self.gen(x_in)
 
-        return [chw_array_to_img(x) for x in chainer.cuda.to_cpu(x_out.data)]
+        return chainer.cuda.to_cpu(x_out.data)
+
+    def __call__(self, imgs):
+        x = np.asarray([img_to_chw_array(img) for img in imgs])
+        return [chw_array_to_img(x) for x in self.convert_array(x)]
+
+class PatchCache:
+    '''
+    bounded LRU of converted patches keyed by converter, mode and input content
+    '''
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self.entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, converter, mode, patch):
+        patch = np.ascontiguousarray(patch)
+        return (
+            converter.get_identity(),
+            mode,
+            patch.shape,
+            hashlib.sha1(patch.data).hexdigest(),
+        )
+
+    def get(self, key):
+        value = self.entries.get(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.entries.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self.entries)
+
+def feather_window(w, h, overlap):
+    '''
+    (h, w) weights ramping linearly over `overlap` pixels at each edge, so
+    that weights of tiles overlapping by that much sum to one
+    '''
+    def ramp(n):
+        p = np.arange(n, dtype=np.float32) + 0.5
+        if overlap == 0:
+            return np.ones(n, dtype=np.float32)
+        return np.minimum(1.0, np.minimum(p, n - p) / overlap)
+    return np.outer(ramp(h), ramp(w))
 
 class PatchedExecuter:
-    def __init__(self, converter, is_alignment_required, batch_size, handler=None):
-        self.patch_size = converter.get_input_size() // 2
+    '''
+    converts an image tile by tile; only the core of each tile is kept and
+    `halo` pixels on each side are used as context.
+
+    By default tiles are converter.get_input_size() wide with a halo of a
+    quarter of that (the center half is kept). If memory_budget (bytes) is
+    given, the converter must accept any multiple of get_size_unit() and
+    tiles are as large as the budget allows, up to the whole padded image.
+
+    If overlap (ratio of get_input_size() shared by adjacent tiles) is
+    given instead of halo, whole tiles are kept and blended with linear
+    feathering over the overlapping part.
+
+    With a PatchCache, identical input tiles are converted once and only
+    tiles missing from the cache are sent to the converter.
+
+    skip_uniform skips the converter for input tiles of a single color:
+    fully transparent tiles are always copied, other single-color tiles
+    are copied ('copy') or converted once per color and shape ('lut'),
+    keeping the conversions of the uniform_lut_size most recent colors.
+    '''
+    def __init__(self, converter, is_alignment_required, batch_size, handler=None, halo=None, memory_budget=None, overlap=None, cache=None, mode=None, skip_uniform=None, uniform_lut_size=1024):
+        self.input_size = converter.get_input_size()
+        if overlap is not None:
+            if halo is not None:
+                raise ValueError('halo and overlap are exclusive')
+            halo = int(round(overlap * self.input_size / 2))
+        self.halo = self.input_size // 4 if halo is None else halo
+        self.blend = overlap is not None
         self.batch_size = batch_size
         self.converter = converter
         self.is_alignment_required = is_alignment_required
         self.handler = NullConversionEventHandler() if handler is None else handler
+        self.cache = cache
+        self.mode = mode
+        if skip_uniform not in (None, 'copy', 'lut'):
+            raise ValueError('unknown skip_uniform {}'.format(skip_uniform))
+        self.skip_uniform = skip_uniform
+        self.uniform_lut = PatchCache(uniform_lut_size)
+        self.memory_budget = memory_budget
+        if memory_budget is None:
+            self.max_input_size = self.input_size
+        else:
+            unit = converter.get_size_unit()
+            if unit is None:
+                raise ValueError('memory_budget requires a converter accepting arbitrary input sizes')
+            self.size_unit = unit
+            self.max_input_size = unit
+            while converter.estimate_memory(
+                self.max_input_size + unit, self.max_input_size + unit, batch_size,
+            ) <= memory_budget:
+                self.max_input_size += unit
+        if self.max_input_size - 2 * self.halo <= 0:
+            raise ValueError('halo {} is too large for tiles of {}'.format(self.halo, self.max_input_size))
 
-    def __call__(self, img):
-        ps = self.patch_size
+    def _fit_tile(self, length):
+        max_core = self.max_input_size - 2 * self.halo
+        n = math.ceil(length / max_core)
+        core = math.ceil(length / n)
+        unit = self.size_unit
+        return unit * math.ceil((core + 2 * self.halo) / unit) - 2 * self.halo
+
+    def get_tile_size(self, w, h):
+        '''
+        (width, height) of the core of each tile for a w x h image
+        '''
+        if self.memory_budget is None:
+            core = self.input_size - 2 * self.halo
+            return core, core
+        return self._fit_tile(w), self._fit_tile(h)
+
+    def _batch_memory(self, tw, th, batch_size):
+        # float32 input and output batches and the converter's own buffers
+        tile_w, tile_h = tw + 2 * self.halo, th + 2 * self.halo
+        return 2 * 4 * 4 * tile_w * tile_h * batch_size + self.converter.estimate_memory(tile_h, tile_w, batch_size)
+
+    def estimate_peak_memory(self, w, h, batch_size=None):
+        '''
+        rough peak bytes of converting a w x h image with __call__: the
+        RGBA image and its padded (and aligned) copies, the float32 CHW
+        array the tiles are taken from, the output canvas, a batch of tiles
+        and the converter's buffers for it (see Converter.estimate_memory)
+        '''
+        batch_size = self.batch_size if batch_size is None else batch_size
+        tw, th = self.get_tile_size(w, h)
+        n_i, n_j = math.ceil(w / tw), math.ceil(h / th)
+        padded = 4 * (n_i * tw + 2 * self.halo) * (n_j * th + 2 * self.halo)
+        image = 4 * w * h
+        # np.asarray, np.pad and Image.fromarray copies (and the aligned image)
+        prepare = image + 3 * padded
+        x = 4 * padded
+        if self.blend:
+            canvas = x + padded
+        else:
+            canvas = 4 * n_i * tw * n_j * th
+        convert = image + x + canvas + self._batch_memory(tw, th, batch_size)
+        # the cropped result is copied from the canvas
+        finish = image + x + canvas + image
+        return max(prepare, convert, finish)
+
+    def estimate_stream_memory(self, w, h, batch_size=None, band_size=1):
+        '''
+        rough peak bytes of stream() on a w x h (preprocessed) image besides
+        the source array: two bands of tiles in flight, each as gathered
+        uint8 rows, float32 CHW array and output canvas, plus a batch of
+        tiles and the converter's buffers
+        '''
+        batch_size = self.batch_size if batch_size is None else batch_size
+        tw, th = self.get_tile_size(w, h)
+        n_i = math.ceil(w / tw)
+        band = 4 * (n_i * tw + 2 * self.halo) * (band_size * th + 2 * self.halo)
+        canvas = 4 * n_i * tw * band_size * th
+        return 2 * (2 * band + 4 * band + canvas) + canvas + self._batch_memory(tw, th, batch_size)
+
+    def _uniform_key(self, patch):
+        '''
+        None if patch has more than one color, 'transparent' if every pixel
+        is transparent, ('uniform', color, shape) otherwise
+        '''
+        if (patch[3] == -1.0).all():
+            return 'transparent'
+        color = patch[:, :1, :1]
+        if (patch == color).all():
+            return ('uniform', tuple(color.ravel().tolist()), patch.shape)
+        return None
+
+    def _iter_converted(self, items):
+        '''
+        yield (job, idx, converted patch) for (job, idx) items in batches of
+        patches of the same shape, possibly spanning several jobs
+        '''
+        pending = collections.OrderedDict()
+        def _flush():
+            keys = list(pending)
+            with self.timed('extract'):
+                batch = np.asarray([job.patch(idx) for job, idx in (pending[key][0] for key in keys)])
+            for job in set(job for key in keys for job, _ in pending[key]):
+                job.stats['batches'] += 1
+            with self.timed('forward'):
+                converted = self.converter.convert_array(batch)
+            for key, converted_patch in zip(keys, converted):
+                pending[key][0][0].stats['converted'] += 1
+                if isinstance(key, tuple) and key[0] == 'uniform':
+                    converted_patch = converted_patch.copy()
+                    self.uniform_lut.put(key, converted_patch)
+                elif self.cache is not None:
+                    converted_patch = converted_patch.copy()
+                    self.cache.put(key, converted_patch)
+                for job, idx in pending[key]:
+                    yield job, idx, converted_patch
+            pending.clear()
+
+        for job, idx in items:
+            patch = job.patch(idx)
+            if pending and patch.shape != batch_shape:
+                yield from _flush()
+            key = None
+            if self.skip_uniform is not None:
+                key = self._uniform_key(patch)
+                if key == 'transparent' or (key is not None and self.skip_uniform == 'copy'):
+                    job.stats['skipped'] += 1
+                    yield job, idx, patch
+                    continue
+                if key is not None and key in pending:
+                    job.stats['skipped'] += 1
+                    pending[key].append((job, idx))
+                    continue
+                converted_patch = None if key is None else self.uniform_lut.get(key)
+                if converted_patch is not None:
+                    job.stats['skipped'] += 1
+                    yield job, idx, converted_patch
+                    continue
+            if key is None and self.cache is None:
+                key = (id(job), idx)
+            elif key is None:
+                key = self.cache.key(self.converter, self.mode, patch)
+                if key in pending:
+                    # duplicate of a patch in the current batch
+                    self.cache.hits += 1
+                    job.stats['cached'] += 1
+                    pending[key].append((job, idx))
+                    continue
+                converted_patch = self.cache.get(key)
+                if converted_patch is not None:
+                    job.stats['cached'] += 1
+                    yield job, idx, converted_patch
+                    continue
+            pending[key] = [(job, idx)]
+            batch_shape = patch.shape
+            if len(pending) == self.batch_size:
+                yield from _flush()
+        if pending:
+            yield from _flush()
+
+    def timed(self, stage):
+        '''
+        context reporting the duration of a stage to the handler
+        '''
+        return timed(self.handler, stage)
+
+    def _prepare(self, img):
+        halo = self.halo
         w_org, h_org = img.size
-        img = pad_by_multiply_of(img, ps, ps // 2)
+        tw, th = self.get_tile_size(w_org, h_org)
+        with self.timed('pad'):
+            img = pad_by_multiply_of(img, (tw, th), halo)
         if self.is_alignment_required:
-            img = align_2x_nearest_neighbor_scaled_image(img)
-        
-        n_i = (img.size[0] - ps // 2 * 2) // ps
-        n_j = (img.size[1] - ps // 2 * 2) // ps
-        converted_img = Image.new('RGBA', (
-            img.size[0] - ps // 2 * 2,
-            img.size[1] - ps // 2 * 2,
-        ))
-        def _patch_generator():            
-            for i in range(n_i):
-                for j in range(n_j):
-                    x = i * ps
-                    y = j * ps
-                    yield (i, j, x, y), img.crop((
-                        x,
-                        y,
-                        x + 2 * ps,
-                        y + 2 * ps,
-                    ))
-        for chunk in chunks(_patch_generator(), self.batch_size):
-            cords, batch = map(list, zip(*chunk))
-            converted_batch = self.converter(batch)
-            for (i, j, x, y), converted_patch in zip(cords, converted_batch):
-                converted_img.paste(
-                    converted_patch.crop((
-                        ps // 2, ps // 2,
-                        ps // 2 + ps, ps // 2 + ps,
-                    )),
-                    (x, y),
+            with self.timed('align'):
+                img = align_2x_nearest_neighbor_scaled_image(img)
+
+        with self.timed('extract'):
+            x = img_to_chw_array(img)
+            job = _Job((w_org, h_org), (tw, th), halo, extract_patches(x, (tw + 2 * halo, th + 2 * halo), (tw, th)))
+        if self.blend:
+            job.window = feather_window(tw + 2 * halo, th + 2 * halo, 2 * halo)
+            job.blended = np.zeros(x.shape, dtype=np.float32)
+            job.weight = np.zeros(x.shape[1:], dtype=np.float32)
+        else:
+            job.converted = np.empty((job.n_j * th, job.n_i * tw, x.shape[0]), dtype=np.uint8)
+        return job
+
+    def _put(self, job, idx, converted_patch):
+        halo = job.halo
+        tw, th = job.tile_size
+        i, j = divmod(idx, job.n_j)
+        with self.timed('stitch'):
+            if self.blend:
+                region = (slice(j * th, (j + 1) * th + 2 * halo), slice(i * tw, (i + 1) * tw + 2 * halo))
+                job.blended[(slice(None),) + region] += job.window * converted_patch
+                job.weight[region] += job.window
+            else:
+                job.converted[j * th:(j + 1) * th, i * tw:(i + 1) * tw] = chw_array_to_hwc_uint8(
+                    converted_patch[:, halo:halo + th, halo:halo + tw]
                 )
-                self.handler.on_patch(converted_patch, i * n_j + j, n_i * n_j)
-        w_conv, h_conv = converted_img.size
+        job.remaining -= 1
+        self.handler.on_patch(converted_patch, job.offset + idx, job.total)
+
+    def _finish(self, job):
+        halo = job.halo
+        tw, th = job.tile_size
+        w_org, h_org = job.size
+        self.handler.on_image(dict(job.stats, patches=job.n, pixels=w_org * h_org))
+        if self.blend:
+            with self.timed('stitch'):
+                core = (slice(halo, halo + job.n_j * th), slice(halo, halo + job.n_i * tw))
+                converted = chw_array_to_hwc_uint8(job.blended[(slice(None),) + core] / job.weight[core])
+        else:
+            converted = job.converted
+        h_conv, w_conv = converted.shape[:2]
         w_pad, h_pad = (w_conv - w_org, h_conv - h_org)
-        return converted_img.crop((
-            w_pad // 2,
-            h_pad // 2,
-            w_pad // 2 + w_org,
-            h_pad // 2 + h_org
-        ))        
+        with self.timed('crop'):
+            return Image.fromarray(converted[
+                h_pad // 2:h_pad // 2 + h_org,
+                w_pad // 2:w_pad // 2 + w_org,
+            ])
+
+    def map(self, imgs):
+        '''
+        convert an iterable of images lazily, filling converter batches
+        with patches of consecutive images; yields results in order
+        '''
+        jobs = collections.deque()
+        def _items():
+            for img in imgs:
+                job = self._prepare(img)
+                jobs.append(job)
+                for idx in range(job.n):
+                    yield job, idx
+        for job, idx, converted_patch in self._iter_converted(_items()):
+            self._put(job, idx, converted_patch)
+            while jobs and jobs[0].remaining == 0:
+                yield self._finish(jobs.popleft())
 
+    def __call__(self, img):
+        return next(self.map([img]))
+
+    def _source_index(self, index, tile):
+        '''
+        index into the source axis of each pixel of the padded (and aligned)
+        axis of a preprocessed axis given by index, and the padding before it
+        '''
+        n = len(index)
+        padded = tile * math.ceil(n / tile)
+        before = (padded - n) // 2
+        index = index[reflect_index(np.arange(padded + 2 * self.halo) - before - self.halo, n)]
+        if self.is_alignment_required:
+            m = len(index)
+            index = index[nearest_index(m, m // 2)[nearest_index(m // 2, m)]]
+        return index, before
+
+    def stream(self, src, write, pre_index=None, post_index=None, band_size=1):
+        '''
+        convert HWC uint8 RGBA array src (e.g. a memmap) band by band and
+        pass consecutive rows of the result to write; only band_size rows
+        of tiles are held at a time. The output is identical to __call__.
+
+        pre_index(n) / post_index(n) give the source index of each pixel of
+        a nearest-neighbor resize of an axis of n pixels done before / after
+        the conversion (None for no resize).
+        '''
+        if self.blend:
+            raise ValueError('streaming does not support overlap blending')
+        h_src, w_src = src.shape[:2]
+        rows = np.arange(h_src) if pre_index is None else pre_index(h_src)
+        cols = np.arange(w_src) if pre_index is None else pre_index(w_src)
+        h, w = len(rows), len(cols)
+        halo = self.halo
+        tw, th = self.get_tile_size(w, h)
+        rows, top = self._source_index(rows, th)
+        cols, left = self._source_index(cols, tw)
+        n_i = (len(cols) - 2 * halo) // tw
+        n_j = (len(rows) - 2 * halo) // th
+        # rows and columns of the converted canvas in the output
+        out_rows = top + (np.arange(h) if post_index is None else post_index(h))
+        out_cols = left + (np.arange(w) if post_index is None else post_index(w))
+
+        jobs = collections.deque()
+        def _items():
+            for j0 in range(0, n_j, band_size):
+                j1 = min(j0 + band_size, n_j)
+                with self.timed('extract'):
+                    band = src[rows[j0 * th:j1 * th + 2 * halo]][:, cols]
+                    x = band.astype("f").transpose((2, 0, 1)) / 127.5 - 1.0
+                    job = _Job((n_i * tw, (j1 - j0) * th), (tw, th), halo, extract_patches(x, (tw + 2 * halo, th + 2 * halo), (tw, th)))
+                job.converted = np.empty(((j1 - j0) * th, n_i * tw, x.shape[0]), dtype=np.uint8)
+                job.top = j0 * th
+                job.offset = n_i * j0
+                job.total = n_i * n_j
+                jobs.append(job)
+                for idx in range(job.n):
+                    yield job, idx
+        stats = collections.Counter(converted=0, cached=0, skipped=0, batches=0)
+        for job, idx, converted_patch in self._iter_converted(_items()):
+            self._put(job, idx, converted_patch)
+            while jobs and jobs[0].remaining == 0:
+                job = jobs.popleft()
+                stats.update(job.stats)
+                lo, hi = np.searchsorted(out_rows, [job.top, job.top + len(job.converted)])
+                with self.timed('crop'):
+                    rows_out = job.converted[out_rows[lo:hi] - job.top][:, out_cols]
+                with self.timed('save'):
+                    write(rows_out)
+        self.handler.on_image(dict(stats, patches=n_i * n_j, pixels=w * h))
+
+class _Job:
+    '''
+    conversion state of a single image in PatchedExecuter
+    '''
+    def __init__(self, size, tile_size, halo, patches):
+        self.size = size
+        self.tile_size = tile_size
+        self.halo = halo
+        self.patches = patches
+        self.n_i, self.n_j = patches.shape[:2]
+        self.n = self.n_i * self.n_j
+        self.remaining = self.n
+        self.stats = collections.Counter(converted=0, cached=0, skipped=0, batches=0)
+        # numbering of patches reported to the handler (differs for bands of a stream)
+        self.offset = 0
+        self.total = self.n
+
+    def patch(self, idx):
+        return self.patches[divmod(idx, self.n_j)]
+
+class Scaler:
+    def preprocess(self, img):
+        return img
+
+    def postprocess(self, img):
+        return img
 
-class Upscaler:
-    def __init__(self, converter, batch_size=1, handler=None):
+    def __call__(self, img):
+        return self.postprocess(self.executor(self.preprocess(img)))
+
+    def map(self, imgs):
+        '''
+        convert an iterable of images, batching patches across images
+        '''
+        for img in self.executor.map(self.preprocess(img) for img in imgs):
+            yield self.postprocess(img)
+
+    # index maps of preprocess / postprocess for streaming (None: identity)
+    preprocess_index = None
+    postprocess_index = None
+
+    def get_output_size(self, w, h):
+        return w, h
+
+    def get_preprocessed_size(self, w, h):
+        return w, h
+
+    def estimate_peak_memory(self, w, h, batch_size=None, stream=False, band_size=1):
+        '''
+        rough peak bytes of converting a w x h image (held in memory as
+        RGBA) by __call__ or, if stream, by stream()
+        (see PatchedExecuter.estimate_peak_memory / estimate_stream_memory)
+        '''
+        pw, ph = self.get_preprocessed_size(w, h)
+        if stream:
+            return 4 * w * h + self.executor.estimate_stream_memory(pw, ph, batch_size, band_size)
+        return 4 * w * h + self.executor.estimate_peak_memory(pw, ph, batch_size)
+
+    def stream(self, src, write, band_size=1):
+        '''
+        convert HWC uint8 RGBA array src band by band, passing consecutive
+        rows of the result to write (see PatchedExecuter.stream)
+        '''
+        self.executor.stream(src, write, self.preprocess_index, self.postprocess_index, band_size)
+
+class Upscaler(Scaler):
+    def __init__(self, converter, batch_size=1, handler=None, **kwargs):
         self.executor = PatchedExecuter(
             converter,
             is_alignment_required=True,
             batch_size=batch_size,
             handler=handler,
+            mode='up',
+            **kwargs
         )
 
+    @staticmethod
     def generate_comparable_image(img):
         return img.resize((img.size[0] * 2, img.size[1] * 2), Image.NEAREST)        
 
-    def __call__(self, img):
-        img = img.resize((img.size[0] * 2, img.size[1] * 2), Image.NEAREST)
-        return self.executor(img)
+    def preprocess(self, img):
+        with self.executor.timed('resize'):
+            return img.resize((img.size[0] * 2, img.size[1] * 2), Image.NEAREST)
 
-class Downscaler:
-    def __init__(self, converter, batch_size=1, handler=None):
+    @staticmethod
+    def preprocess_index(n):
+        return nearest_index(n, n * 2)
+
+    def get_output_size(self, w, h):
+        return w * 2, h * 2
+
+    def get_preprocessed_size(self, w, h):
+        return w * 2, h * 2
+
+class Downscaler(Scaler):
+    def __init__(self, converter, batch_size=1, handler=None, **kwargs):
         self.executor = PatchedExecuter(
             converter,
             is_alignment_required=False,
             batch_size=batch_size,
             handler=handler,
+            mode='down',
+            **kwargs
         )
 
+    @staticmethod
     def generate_comparable_image(img):
         return img.resize((img.size[0] // 2, img.size[1] // 2), Image.NEAREST)
 
-    def __call__(self, img):
-        img = self.executor(img)
-        return img.resize((img.size[0] // 2, img.size[1] // 2), Image.NEAREST)
+    def postprocess(self, img):
+        with self.executor.timed('resize'):
+            return img.resize((img.size[0] // 2, img.size[1] // 2), Image.NEAREST)
 
-class Refiner:
-    def __init__(self, converter, batch_size=1, handler=None):
+    @staticmethod
+    def postprocess_index(n):
+        return nearest_index(n, n // 2)
+
+    def get_output_size(self, w, h):
+        return w // 2, h // 2
+
+class Refiner(Scaler):
+    def __init__(self, converter, batch_size=1, handler=None, **kwargs):
         self.executor = PatchedExecuter(
             converter,
             is_alignment_required=True,
             batch_size=batch_size,
             handler=handler,
+            mode='refine',
+            **kwargs
         )
 
+    @staticmethod
     def generate_comparable_image(img):
         return img
 
-    def __call__(self, img):
-        return self.executor(img)
+MODES = ('up', 'down', 'refine')
+
+def build_scaler(converter, mode, **options):
+    if mode == 'up':
+        return Upscaler(converter, **options)
+    elif mode == 'down':
+        return Downscaler(converter, **options)
+    elif mode == 'refine':
+        return Refiner(converter, **options)
+    else:
+        raise RuntimeError("unknown mode: {}".format(mode))
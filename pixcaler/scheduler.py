@@ -0,0 +1,156 @@
+import collections
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+
+
+class SchedulerClosed(RuntimeError):
+    pass
+
+class _Request:
+    def __init__(self, scaler, job, future):
+        self.scaler = scaler
+        self.job = job
+        self.future = future
+        self.submitted = time.monotonic()
+
+class BatchScheduler:
+    '''
+    converts the patches of concurrent requests in shared converter
+    batches on a worker thread.
+
+    A batch is run as soon as max_batch_size patches are queued, or
+    max_delay seconds after its oldest patch was queued. Requests are
+    (scaler, image) pairs whose scalers wrap the same converter; patch
+    caches and skip_uniform of the scalers are not used.
+    '''
+    def __init__(self, converter, max_batch_size=8, max_delay=0.005, history=10000):
+        self.converter = converter
+        self.max_batch_size = max_batch_size
+        self.max_delay = max_delay
+        self.cond = threading.Condition()
+        # (request, patch index) in arrival order
+        self.queue = collections.deque()
+        self.closed = False
+        self.latencies = collections.deque(maxlen=history)
+        self.n_requests = 0
+        self.n_batches = 0
+        self.n_patches = 0
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def submit(self, scaler, img):
+        '''
+        future of scaler(img)
+        '''
+        executor = scaler.executor
+        job = executor._prepare(scaler.preprocess(img))
+        request = _Request(scaler, job, Future())
+        with self.cond:
+            if self.closed:
+                raise SchedulerClosed()
+            self.queue.extend((request, idx) for idx in range(job.n))
+            self.cond.notify()
+        return request.future
+
+    def _take(self):
+        with self.cond:
+            while not self.queue and not self.closed:
+                self.cond.wait()
+            if not self.queue:
+                return None
+            deadline = self.queue[0][0].submitted + self.max_delay
+            while len(self.queue) < self.max_batch_size and not self.closed:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                self.cond.wait(timeout)
+            items = []
+            shape = None
+            while self.queue and len(items) < self.max_batch_size:
+                request, idx = self.queue[0]
+                try:
+                    patch = request.job.patch(idx)
+                except Exception as e:
+                    self.queue.popleft()
+                    self._fail([request], e)
+                    continue
+                if shape is not None and patch.shape != shape:
+                    break
+                shape = patch.shape
+                items.append(self.queue.popleft())
+            return items
+
+    @staticmethod
+    def _fail(requests, e):
+        for request in requests:
+            if not request.future.done():
+                request.future.set_exception(e)
+
+    def _run(self):
+        # a failing request only fails its own future; the others and the loop go on
+        while True:
+            items = self._take()
+            if items is None:
+                return
+            items = [(request, idx) for request, idx in items if not request.future.done()]
+            if not items:
+                continue
+            try:
+                converted = self.converter.convert_array(
+                    np.asarray([request.job.patch(idx) for request, idx in items])
+                )
+            except Exception as e:
+                self._fail(set(request for request, _ in items), e)
+                continue
+            self.n_batches += 1
+            self.n_patches += len(items)
+            for request in set(request for request, _ in items):
+                request.job.stats['batches'] += 1
+            for (request, idx), converted_patch in zip(items, converted):
+                if request.future.done():
+                    # failed on an earlier patch of this batch
+                    continue
+                executor = request.scaler.executor
+                request.job.stats['converted'] += 1
+                try:
+                    executor._put(request.job, idx, converted_patch)
+                    if request.job.remaining > 0:
+                        continue
+                    result = request.scaler.postprocess(executor._finish(request.job))
+                except Exception as e:
+                    self._fail([request], e)
+                    continue
+                with self.cond:
+                    self.n_requests += 1
+                    self.latencies.append(time.monotonic() - request.submitted)
+                request.future.set_result(result)
+
+    def stats(self):
+        '''
+        latency percentiles (seconds) of recent requests and the mean
+        fraction of max_batch_size filled by each batch
+        '''
+        with self.cond:
+            latencies = np.asarray(self.latencies)
+            stats = {
+                'requests': self.n_requests,
+                'batches': self.n_batches,
+                'patches': self.n_patches,
+                'queued': len(self.queue),
+                'fill_ratio': self.n_patches / (self.n_batches * self.max_batch_size) if self.n_batches else None,
+            }
+        for p in (50, 95, 99):
+            stats['p{}'.format(p)] = float(np.percentile(latencies, p)) if len(latencies) else None
+        return stats
+
+    def close(self):
+        '''
+        stop accepting requests and return once the queued ones are done
+        '''
+        with self.cond:
+            self.closed = True
+            self.cond.notify()
+        self.thread.join()
@@ -0,0 +1,282 @@
+import argparse
+import collections
+import io
+import json
+import os
+import re
+import socketserver
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from pathlib import Path
+from urllib.parse import urlparse, parse_qs
+from PIL import Image
+
+import chainer
+from pixcaler.net import load_generator
+from pixcaler.scaler import MODES, ChainerConverter, build_scaler
+from pixcaler.util import png_save_options
+from pixcaler.scheduler import BatchScheduler, SchedulerClosed
+
+def latest_generator(directory):
+    '''
+    gen_iter_*.npz of the largest iteration in directory, or None
+    '''
+    found = []
+    for path in Path(directory).glob('gen_iter_*.npz'):
+        m = re.match(r'gen_iter_(\d+)\.npz$', path.name)
+        if m is not None:
+            found.append((int(m.group(1)), path))
+    return max(found)[1] if found else None
+
+class _Loaded:
+    def __init__(self, path, scalers, scheduler):
+        self.path = path
+        self.mtime = path.stat().st_mtime
+        self.scalers = scalers
+        self.scheduler = scheduler
+
+    def convert(self, mode, img):
+        return self.scheduler.submit(self.scalers[mode], img).result()
+
+class Model:
+    '''
+    a resident generator. source is a .npz file, or a directory whose
+    newest gen_iter_*.npz is loaded and followed by reload()
+    '''
+    def __init__(self, source, gpu=-1, patch_size=32, scaler_options=None, max_batch_size=8, max_delay=0.005, freeze=False):
+        self.source = Path(source)
+        self.gpu = gpu
+        self.freeze = freeze
+        self.patch_size = patch_size
+        self.scaler_options = scaler_options or {}
+        self.max_batch_size = max_batch_size
+        self.max_delay = max_delay
+        self.lock = threading.Lock()
+        self.loaded = None
+        if not self.reload():
+            raise RuntimeError('no generator found in {}'.format(source))
+
+    def _resolve(self):
+        if self.source.is_dir():
+            return latest_generator(self.source)
+        return self.source
+
+    def _load(self, path):
+        gen = load_generator(path)
+        if self.freeze:
+            gen = gen.freeze()
+        if self.gpu >= 0:
+            chainer.cuda.get_device(self.gpu).use()
+            gen.to_gpu()
+        converter = ChainerConverter(gen, input_size=self.patch_size * 2)
+        scalers = {mode: build_scaler(converter, mode, **self.scaler_options) for mode in MODES}
+        return _Loaded(path, scalers, BatchScheduler(converter, self.max_batch_size, self.max_delay))
+
+    def reload(self, force=False):
+        '''
+        load the current generator if it differs from the resident one.
+        requests already running keep the old one until they finish
+        '''
+        with self.lock:
+            path = self._resolve()
+            if path is None:
+                return False
+            current = self.loaded
+            if (not force and current is not None and current.path == path
+                    and current.mtime == path.stat().st_mtime):
+                return False
+            self.loaded = self._load(path)
+        if current is not None:
+            current.scheduler.close()
+        print('loaded', path)
+        return True
+
+    def convert(self, mode, img):
+        while True:
+            try:
+                return self.loaded.convert(mode, img)
+            except SchedulerClosed:
+                # swapped by reload() after self.loaded was read
+                continue
+
+    def info(self):
+        return {'source': str(self.source), 'path': str(self.loaded.path)}
+
+    def stats(self):
+        return self.loaded.scheduler.stats()
+
+class RequestHandler(BaseHTTPRequestHandler):
+    '''
+    POST /{up,down,refine}[?model=name] with PNG bytes -> converted PNG
+    POST /reload[?model=name]           reload changed generators
+    GET  /models                        resident generators as JSON
+    GET  /stats                         latency and batching of each generator
+    '''
+    def address_string(self):
+        # client_address is not a (host, port) pair on unix sockets
+        if isinstance(self.client_address, tuple):
+            return self.client_address[0]
+        return self.server.server_address
+
+    def _send(self, code, body, content_type):
+        self.send_response(code)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_json(self, code, obj):
+        self._send(code, json.dumps(obj).encode('utf-8'), 'application/json')
+
+    def _models(self, query):
+        names = query.get('model')
+        if names is None:
+            return None
+        for name in names:
+            if name not in self.server.models:
+                self._send_json(404, {'error': 'unknown model: {}'.format(name)})
+                return []
+        return names
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == '/models':
+            return self._send_json(200, {name: model.info() for name, model in self.server.models.items()})
+        if url.path == '/stats':
+            return self._send_json(200, {name: model.stats() for name, model in self.server.models.items()})
+        self._send_json(404, {'error': 'not found'})
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query, keep_blank_values=True)
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        mode = url.path.strip('/')
+        names = self._models(query)
+        if names == []:
+            return
+        if mode == 'reload':
+            reloaded = {
+                name: self.server.models[name].reload(force='force' in query)
+                for name in names or self.server.models
+            }
+            return self._send_json(200, reloaded)
+        if mode not in MODES:
+            return self._send_json(404, {'error': 'not found'})
+        model = self.server.models[names[0] if names else self.server.default_model]
+        try:
+            with Image.open(io.BytesIO(body)) as img:
+                img = img.convert('RGBA')
+        except (OSError, ValueError) as e:
+            return self._send_json(400, {'error': 'cannot read image: {}'.format(e)})
+        try:
+            converted_img = model.convert(mode, img)
+        except ValueError as e:
+            return self._send_json(400, {'error': 'cannot convert image: {}'.format(e)})
+        except Exception as e:
+            return self._send_json(500, {'error': 'conversion failed: {}'.format(e)})
+        out = io.BytesIO()
+        converted_img.save(out, format='PNG', **self.server.save_options)
+        self._send(200, out.getvalue(), 'image/png')
+
+class ThreadingHTTPServer(socketserver.ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+class ThreadingUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+def watch(models, interval, stop):
+    '''
+    poll the generators of models every interval seconds until stop is set
+    '''
+    while not stop.wait(interval):
+        for name, model in models.items():
+            try:
+                model.reload()
+            except Exception as e:
+                # keep serving the resident generator, e.g. while a snapshot is still being written
+                print('failed to reload {}: {}'.format(name, e))
+
+def main():
+    parser = argparse.ArgumentParser(description='serve pixcaler generators over HTTP')
+    parser.add_argument(
+        '--generator', type=str, action='append', required=True,
+        help='[name=]path to generator model, or to a directory whose newest gen_iter_*.npz is served '
+             'and reloaded when a newer one appears (repeatable; the first is the default)',
+    )
+    parser.add_argument(
+        '--host', type=str, default='127.0.0.1',
+    )
+    parser.add_argument(
+        '--port', type=int, default=8000,
+    )
+    parser.add_argument(
+        '--socket', type=str, default=None,
+        help='listen on this unix socket instead of --host / --port',
+    )
+    parser.add_argument(
+        '--reload_interval', type=float, default=10,
+        help='seconds between checks for newer generators (0 to reload only on POST /reload)',
+    )
+    parser.add_argument(
+        '--gpu', '-g', type=int, default=-1,
+        help='GPU ID (negative value indicates CPU)',
+    )
+    parser.add_argument(
+        '--freeze', action='store_true', default=False,
+        help='fold batch normalization into the convolutions of loaded generators (faster on CPU)',
+    )
+    parser.add_argument(
+        '--patch_size', '-p', type=int, default=32,
+    )
+    parser.add_argument(
+        '--batch_size', '-b', type=int, default=8,
+        help='maximum number of patches, possibly of concurrent requests, converted at once',
+    )
+    parser.add_argument(
+        '--max_delay', type=float, default=5,
+        help='milliseconds a patch may wait for others to fill its batch',
+    )
+    parser.add_argument(
+        '--halo', type=int, default=None,
+        help='context pixels around each tile (default: patch_size // 2)',
+    )
+    parser.add_argument(
+        '--compress_level', type=int, choices=range(10), default=None,
+        help='PNG compression level of responses (0: fastest, 9: smallest)',
+    )
+    args = parser.parse_args()
+
+    scaler_options = dict(
+        halo=args.halo,
+    )
+    models = collections.OrderedDict()
+    for i, spec in enumerate(args.generator):
+        name, sep, source = spec.partition('=')
+        if not sep:
+            name, source = str(i), spec
+        models[name] = Model(source, args.gpu, args.patch_size, scaler_options, args.batch_size, args.max_delay / 1000, args.freeze)
+
+    if args.socket is not None:
+        if os.path.exists(args.socket):
+            os.unlink(args.socket)
+        server = ThreadingUnixHTTPServer(args.socket, RequestHandler)
+    else:
+        server = ThreadingHTTPServer((args.host, args.port), RequestHandler)
+    server.models = models
+    server.default_model = next(iter(models))
+    server.save_options = png_save_options(args.compress_level)
+
+    stop = threading.Event()
+    if args.reload_interval > 0:
+        threading.Thread(target=watch, args=(models, args.reload_interval, stop), daemon=True).start()
+    print('serving on', args.socket or '{}:{}'.format(args.host, args.port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop.set()
+        server.server_close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,140 @@
+import struct
+import zlib
+
+import numpy as np
+
+
+def _png_filter(rows, prev):
+    '''
+    rows of (n, width * 4) uint8 RGBA filtered with the adaptive heuristic
+    of libpng (per row, the filter of the smallest sum of signed bytes)
+    '''
+    n, stride = rows.shape
+    raw = rows.astype(np.int16)
+    up = np.vstack([prev[None], rows[:-1]]).astype(np.int16)
+    left = np.zeros_like(raw)
+    left[:, 4:] = raw[:, :-4]
+    upleft = np.zeros_like(raw)
+    upleft[:, 4:] = up[:, :-4]
+    p = left + up - upleft
+    pa, pb, pc = np.abs(p - left), np.abs(p - up), np.abs(p - upleft)
+    paeth = np.where((pa <= pb) & (pa <= pc), left, np.where(pb <= pc, up, upleft))
+    candidates = np.stack([
+        raw,
+        raw - left,
+        raw - up,
+        raw - (left + up) // 2,
+        raw - paeth,
+    ]).astype(np.uint8)
+    cost = np.abs(candidates.view(np.int8).astype(np.int32)).sum(axis=2)
+    choice = cost.argmin(axis=0)
+    out = np.empty((n, stride + 1), dtype=np.uint8)
+    out[:, 0] = choice
+    out[:, 1:] = candidates[choice, np.arange(n)]
+    return out
+
+class PngStreamWriter:
+    '''
+    writes an RGBA PNG of known size from consecutive bands of HWC uint8
+    rows, so that the whole image is never held in memory
+    '''
+    def __init__(self, path, width, height, compress_level=6, chunk_size=1 << 20):
+        self.width = width
+        self.height = height
+        self.rows = 0
+        self.chunk_size = chunk_size
+        self.compressor = zlib.compressobj(compress_level)
+        self.prev = np.zeros(width * 4, dtype=np.uint8)
+        self.buffer = bytearray()
+        self.file = open(str(path), 'wb')
+        self.file.write(b'\x89PNG\r\n\x1a\n')
+        self._chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 6, 0, 0, 0))
+
+    def _chunk(self, tag, data):
+        self.file.write(struct.pack('>I', len(data)))
+        self.file.write(tag)
+        self.file.write(data)
+        self.file.write(struct.pack('>I', zlib.crc32(data, zlib.crc32(tag)) & 0xffffffff))
+
+    def write(self, rows):
+        '''
+        append rows of shape (n, width, 4)
+        '''
+        if len(rows) == 0:
+            return
+        if rows.shape[1:] != (self.width, 4):
+            raise ValueError('expected rows of shape (n, {}, 4), got {}'.format(self.width, rows.shape))
+        if self.rows + len(rows) > self.height:
+            raise ValueError('more than {} rows written'.format(self.height))
+        rows = np.ascontiguousarray(rows, dtype=np.uint8).reshape((len(rows), self.width * 4))
+        self.buffer += self.compressor.compress(_png_filter(rows, self.prev).tobytes())
+        self.prev = rows[-1].copy()
+        self.rows += len(rows)
+        if len(self.buffer) >= self.chunk_size:
+            self._chunk(b'IDAT', bytes(self.buffer))
+            self.buffer = bytearray()
+
+    def close(self):
+        try:
+            if self.rows != self.height:
+                raise ValueError('{} of {} rows written'.format(self.rows, self.height))
+            self.buffer += self.compressor.flush()
+            self._chunk(b'IDAT', bytes(self.buffer))
+            self._chunk(b'IEND', b'')
+        finally:
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        if exc[0] is None:
+            self.close()
+        else:
+            self.file.close()
+
+def open_rgba(path):
+    '''
+    (H, W, 4) uint8 .npy file as a read-only memmap
+    '''
+    x = np.load(str(path), mmap_mode='r')
+    if x.dtype != np.uint8 or x.ndim != 3 or x.shape[2] != 4:
+        raise ValueError('{} is not a (H, W, 4) uint8 RGBA array: {} {}'.format(path, x.dtype, x.shape))
+    return x
+
+class NpyStreamWriter:
+    '''
+    writes consecutive bands of rows into a (height, width, 4) uint8 .npy
+    memmap, readable by np.load(path, mmap_mode='r') without decoding
+    '''
+    def __init__(self, path, width, height):
+        self.width = width
+        self.height = height
+        self.rows = 0
+        self.array = np.lib.format.open_memmap(str(path), mode='w+', dtype=np.uint8, shape=(height, width, 4))
+
+    def write(self, rows):
+        '''
+        append rows of shape (n, width, 4)
+        '''
+        if rows.shape[1:] != (self.width, 4):
+            raise ValueError('expected rows of shape (n, {}, 4), got {}'.format(self.width, rows.shape))
+        if self.rows + len(rows) > self.height:
+            raise ValueError('more than {} rows written'.format(self.height))
+        self.array[self.rows:self.rows + len(rows)] = rows
+        self.rows += len(rows)
+
+    def close(self):
+        array, self.array = self.array, None
+        array.flush()
+        if self.rows != self.height:
+            raise ValueError('{} of {} rows written'.format(self.rows, self.height))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        if exc[0] is None:
+            self.close()
+        else:
+            self.array = None
@@ -0,0 +1,83 @@
+import json
+import time
+from pathlib import Path
+
+import fire
+import numpy as np
+import chainer
+from PIL import Image
+
+import pixcaler.net
+from pixcaler.scaler import ChainerConverter, build_scaler
+from pixcaler.quantize import PRECISIONS, quantize, stored_bytes
+
+def calibrate(
+    generator,
+    *images,
+    input_dir='image/dataset/test',
+    mode='up',
+    precisions=PRECISIONS,
+    patch_size=32,
+    batch_size=4,
+    gpu=-1,
+    out=None):
+    '''
+    convert the test images at each precision and print the size of the
+    stored weights, the speedup (of folding batch normalization only; all
+    precisions compute in float32) and the per-pixel deviation against the
+    float32 Generator (save the chosen one with
+    `python -m pixcaler.tool.freeze-generator --precision`)
+    '''
+    if isinstance(precisions, str):
+        precisions = precisions.split(',')
+    gen = pixcaler.net.load_generator(generator)
+    if gpu >= 0:
+        chainer.cuda.get_device(gpu).use()
+        gen.to_gpu()
+
+    paths = [Path(image) for image in images] or sorted(Path(input_dir).glob('*.png'))
+    imgs = []
+    for path in paths:
+        with Image.open(str(path)) as img:
+            imgs.append(img.convert('RGBA'))
+    if not imgs:
+        raise RuntimeError('no png images in {}'.format(input_dir))
+
+    def _run(model):
+        scaler = build_scaler(ChainerConverter(model, patch_size * 2), mode, batch_size=batch_size)
+        # the first call includes one-time allocations
+        scaler(imgs[0])
+        start = time.perf_counter()
+        converted = [np.asarray(scaler(img), dtype=np.int32) for img in imgs]
+        return converted, time.perf_counter() - start
+
+    refs, ref_seconds = _run(gen)
+    results = []
+    for precision in precisions:
+        model = quantize(gen, precision)
+        converted, seconds = _run(model)
+        diffs = [np.abs(x - ref) for x, ref in zip(converted, refs)]
+        results.append({
+            'precision': precision,
+            'weight_bytes': stored_bytes(gen, precision),
+            'seconds': seconds,
+            'speedup': ref_seconds / seconds,
+            'max_error': int(max(d.max() for d in diffs)),
+            'mean_error': float(np.mean([d.mean() for d in diffs])),
+            'changed_pixels': float(np.mean([d.max(axis=2).astype(bool).mean() for d in diffs])),
+        })
+        print(
+            '{precision:<8} weights={mb:>6.1f}MiB {seconds:>8.2f}s speedup={speedup:.2f} '
+            'max={max_error} mean={mean_error:.4f} changed={changed:.2f}%'.format(
+                mb=results[-1]['weight_bytes'] / 2 ** 20,
+                changed=results[-1]['changed_pixels'] * 100,
+                **results[-1]
+            )
+        )
+    print('reference (Generator, float32): {:.2f}s'.format(ref_seconds))
+    if out is not None:
+        with open(out, 'w') as f:
+            json.dump(results, f, indent=4, sort_keys=True)
+
+if __name__ == '__main__':
+    fire.Fire(calibrate)
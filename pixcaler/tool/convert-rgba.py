@@ -0,0 +1,35 @@
+from pathlib import Path
+
+import fire
+import numpy as np
+from PIL import Image
+
+from pixcaler.stream import PngStreamWriter, NpyStreamWriter, open_rgba
+
+def to_png(src, dst=None, band=1024, compress_level=6):
+    '''
+    encode a (H, W, 4) uint8 .npy file as PNG, band rows at a time
+    '''
+    src = Path(src)
+    dst = src.with_suffix('.png') if dst is None else Path(dst)
+    x = open_rgba(src)
+    h, w = x.shape[:2]
+    with PngStreamWriter(dst, w, h, compress_level) as writer:
+        for i in range(0, h, band):
+            writer.write(np.asarray(x[i:i + band]))
+    print(src, '->', dst)
+
+def to_npy(src, dst=None):
+    '''
+    decode an image into a (H, W, 4) uint8 .npy file
+    '''
+    src = Path(src)
+    dst = src.with_suffix('.npy') if dst is None else Path(dst)
+    with Image.open(str(src)) as img:
+        x = np.asarray(img.convert('RGBA'))
+    with NpyStreamWriter(dst, x.shape[1], x.shape[0]) as writer:
+        writer.write(x)
+    print(src, '->', dst)
+
+if __name__ == '__main__':
+    fire.Fire({'to_png': to_png, 'to_npy': to_npy})
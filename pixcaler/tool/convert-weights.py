@@ -0,0 +1,67 @@
+from pathlib import Path
+
+import fire
+import numpy as np
+import chainer
+import keras
+
+import pixcaler.net
+import pixcaler.keras.model
+import pixcaler.keras.weights
+
+SIZE = 64
+
+def _keras_generator(in_ch, out_ch, base_ch):
+    x, h = pixcaler.keras.model.generator(SIZE, in_ch, out_ch, base_ch)
+    return keras.models.Model(x, h, name='Generator')
+
+def _check_output(path):
+    if path.exists():
+        print("{} is already exists".format(path))
+        exit(-1)
+
+def to_h5(npz, h5=None):
+    '''
+    convert a Chainer generator (gen_iter_*.npz) to Keras weights
+    (loadable by `python -m pixcaler.keras.run export_generator`)
+    '''
+    npz = Path(npz)
+    h5 = npz.with_suffix('.h5') if h5 is None else Path(h5)
+    _check_output(h5)
+    gen = pixcaler.net.load_generator(npz)
+    model = _keras_generator(gen.in_ch, gen.out_ch, gen.base_ch)
+    pixcaler.keras.weights.to_keras(gen, model)
+    model.save_weights(str(h5))
+    print(npz, '->', h5)
+
+def to_npz(h5, npz=None, in_ch=4, out_ch=4, base_ch=64):
+    '''
+    convert Keras generator weights (gen_*.h5) to a Chainer generator
+    '''
+    h5 = Path(h5)
+    npz = h5.with_suffix('.npz') if npz is None else Path(npz)
+    _check_output(npz)
+    model = _keras_generator(in_ch, out_ch, base_ch)
+    model.load_weights(str(h5))
+    gen = pixcaler.net.Generator(in_ch, out_ch, base_ch)
+    pixcaler.keras.weights.from_keras(model, gen)
+    chainer.serializers.save_npz(str(npz), gen)
+    print(h5, '->', npz)
+
+def parity(npz, h5, batch_size=4, seed=0):
+    '''
+    max output difference of the two models on the same random 64x64 inputs
+    '''
+    gen = pixcaler.net.load_generator(npz)
+    model = _keras_generator(gen.in_ch, gen.out_ch, gen.base_ch)
+    model.load_weights(str(h5))
+    x = np.random.RandomState(seed).uniform(-1, 1, (batch_size, gen.in_ch, SIZE, SIZE)).astype('f')
+    with chainer.using_config('train', False), chainer.using_config('enable_back_prop', False):
+        y_chainer = gen(x).data
+    y_keras = model.predict(x.transpose((0, 2, 3, 1))).transpose((0, 3, 1, 2))
+    diff = np.abs(y_chainer - y_keras)
+    print('max |diff|: {:.3e}, mean |diff|: {:.3e}'.format(diff.max(), diff.mean()))
+    return float(diff.max())
+
+if __name__ == '__main__':
+    fire.Fire({'to_h5': to_h5, 'to_npz': to_npz, 'parity': parity})
@@ -0,0 +1,29 @@
+from pathlib import Path
+
+import fire
+
+import pixcaler.net
+from pixcaler.quantize import quantize
+from pixcaler.onnx_backend import export_generator, quantize_model
+
+def export(generator, out=None, precision='float32', opset=13):
+    '''
+    export a generator model to ONNX with dynamic batch and spatial size
+    (run it with `python -m pixcaler.run --backend onnx --generator out.onnx`);
+    int8 precision quantizes the convolutions to run in int8 (see
+    pixcaler.onnx_backend.quantize_model), float16 only rounds the weights
+    '''
+    import onnx
+
+    generator = Path(generator)
+    out = generator.with_suffix('.onnx') if out is None else Path(out)
+    gen = pixcaler.net.load_generator(generator)
+    model = export_generator(quantize(gen, 'float32' if precision == 'int8' else precision), opset)
+    if precision == 'int8':
+        model = onnx.load_model_from_string(quantize_model(model.SerializeToString()))
+    onnx.checker.check_model(model)
+    onnx.save(model, str(out))
+    print(generator, '->', out)
+
+if __name__ == '__main__':
+    fire.Fire(export)
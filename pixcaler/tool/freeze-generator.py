@@ -0,0 +1,31 @@
+from pathlib import Path
+
+import fire
+import chainer
+
+import pixcaler.net
+from pixcaler.quantize import PRECISIONS, save_quantized
+
+def freeze(generator, out=None, precision='float32'):
+    '''
+    save the inference-only FrozenGenerator of a generator model
+    (usable anywhere a generator is loaded, e.g. `python -m pixcaler.run --generator`);
+    float16 or int8 precision stores the weights in 1/2 or 1/4 of the bytes,
+    they are expanded to float32 when loaded
+    '''
+    if precision not in PRECISIONS:
+        raise ValueError('unknown precision {}'.format(precision))
+    generator = Path(generator)
+    out = generator.with_name(generator.stem + '_frozen.npz') if out is None else Path(out)
+    if out.exists():
+        print("{} is already exists".format(out))
+        exit(-1)
+    gen = pixcaler.net.load_generator(generator)
+    if precision == 'float32':
+        chainer.serializers.save_npz(str(out), gen.freeze())
+    else:
+        save_quantized(gen, out, precision)
+    print(generator, '->', out)
+
+if __name__ == '__main__':
+    fire.Fire(freeze)
@@ -0,0 +1,51 @@
+from pathlib import Path
+
+import fire
+import chainer
+from PIL import Image
+
+import pixcaler.net
+from pixcaler.scaler import ChainerConverter
+from pixcaler.receptive import measure_edge_error, minimal_halo
+from pixcaler.util import img_to_chw_array, pad_by_multiply_of, align_2x_nearest_neighbor_scaled_image
+
+def measure(
+    generator,
+    *images,
+    input_dir='image/dataset/test',
+    mode='up',
+    patch_size=32,
+    tolerance=0,
+    step=2,
+    n_windows=8,
+    gpu=-1):
+    '''
+    print the max output difference by distance from the tile edge and the
+    minimal halo to pass to `python -m pixcaler.run --halo`
+    '''
+    gen = pixcaler.net.load_generator(generator)
+    if gpu >= 0:
+        chainer.cuda.get_device(gpu).use()
+        gen.to_gpu()
+    converter = ChainerConverter(gen, patch_size * 2)
+
+    paths = [Path(image) for image in images] or sorted(Path(input_dir).glob('*.png'))
+    xs = []
+    for path in paths:
+        with Image.open(str(path)) as img:
+            img = img.convert('RGBA')
+            if mode == 'up':
+                img = img.resize((img.size[0] * 2, img.size[1] * 2), Image.NEAREST)
+            img = pad_by_multiply_of(img, gen.size_unit, patch_size * 2)
+            if mode != 'down':
+                img = align_2x_nearest_neighbor_scaled_image(img)
+            xs.append(img_to_chw_array(img))
+
+    edge_error = measure_edge_error(converter, xs, n_windows=n_windows)
+    for d, e in enumerate(edge_error):
+        print('{:>4}: {}'.format(d, e))
+    halo = minimal_halo(edge_error, tolerance, step)
+    print('minimal halo:', halo)
+
+if __name__ == '__main__':
+    fire.Fire(measure)
@@ -15,7 +15,7 @@ from chainerui.extensions import CommandsExtension
 from pixcaler.net import Discriminator
 from pixcaler.net import Generator, Pix2Pix
 from pixcaler.updater import CycleUpdater
-from pixcaler.dataset import AutoUpscaleDataset, Single32Dataset
+from pixcaler.dataset import AutoUpscaleDataset, Single32Dataset, make_iterator
 from pixcaler.visualizer import out_image_cycle
 
 def main():
@@ -62,6 +62,10 @@ def main():
         '--preview_interval', type=int, default=100,
         help='Interval of previewing generated image',    
     )
+    parser.add_argument(
+        '--loaders', type=int, default=0,
+        help='number of processes preparing batches of each training dataset (0: on the training thread)',
+    )
     args = parser.parse_args()
     save_args(args, args.out)
 
@@ -106,9 +110,9 @@ def main():
         "{}/trainB".format(args.dataset),
     )
 
-    train_l_iter = chainer.iterators.SerialIterator(train_l_d, args.batchsize)
+    train_l_iter = make_iterator(train_l_d, args.batchsize, args.loaders)
     test_l_iter = chainer.iterators.SerialIterator(test_l_d, 1)
-    train_s_iter = chainer.iterators.SerialIterator(train_s_d, args.batchsize)
+    train_s_iter = make_iterator(train_s_d, args.batchsize, args.loaders)
     test_s_iter = chainer.iterators.SerialIterator(test_s_d, 1)
  
     # Set up a trainer
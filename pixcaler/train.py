@@ -15,7 +15,8 @@ from chainerui.extensions import CommandsExtension
 from pixcaler.net import Discriminator
 from pixcaler.net import Generator, Pix2Pix
 from pixcaler.updater import Pix2PixUpdater
-from pixcaler.dataset import AutoUpscaleDataset, CompositeAutoUpscaleDataset
+from pixcaler.dataset import AutoUpscaleDataset, CompositeAutoUpscaleDataset, make_iterator
+from pixcaler.glyphs import DEFAULT_CACHE
 from pixcaler.visualizer import full_out_image, out_image
 from pixcaler.scaler import ChainerConverter, Upscaler
 
@@ -75,6 +76,25 @@ def main():
         '--composite', action='store_true', default=False,
         help='composite',
     )
+    parser.add_argument(
+        '--loaders', type=int, default=0,
+        help='number of processes preparing training batches (0: on the training thread)',
+    )
+    parser.add_argument(
+        '--asset_cache', type=int, default=1024,
+        help='MiB of decoded composite images each dataset keeps in each process using it; '
+             'the training and test sets are cached separately and every --loaders process '
+             'has its own copy of the training set, so up to (loaders + 1) times this in total '
+             '(twice this without --loaders)',
+    )
+    parser.add_argument(
+        '--preload_assets', action='store_true', default=False,
+        help='decode all composite images before training (shared by --loaders processes)',
+    )
+    parser.add_argument(
+        '--glyph_cache', default=str(DEFAULT_CACHE),
+        help='directory of the glyph atlases of composite text',
+    )
     args = parser.parse_args()
     save_args(args, args.out)
 
@@ -104,9 +124,14 @@ def main():
     if args.composite:
         train_d = CompositeAutoUpscaleDataset(
             args.dataset,
+            cache_bytes=args.asset_cache * 2 ** 20,
+            preload=args.preload_assets,
+            glyph_cache=args.glyph_cache,
         )
         test_d = CompositeAutoUpscaleDataset(
             args.dataset,
+            cache_bytes=args.asset_cache * 2 ** 20,
+            glyph_cache=args.glyph_cache,
         )
     else:
         train_d = AutoUpscaleDataset(
@@ -117,7 +142,7 @@ def main():
             "{}/main".format(args.dataset),
             random_nn=False,
         )
-    train_iter = chainer.iterators.SerialIterator(train_d, args.batchsize)
+    train_iter = make_iterator(train_d, args.batchsize, args.loaders)
     test_iter = chainer.iterators.SerialIterator(test_d, args.batchsize)
 
     # Set up a trainer
@@ -20,6 +20,9 @@ def chw_array_to_img(x):
         np.asarray(np.clip(x * 127.5 + 127.5, 0.0, 255.0), dtype=np.uint8)
     )
 
+def chw_array_to_hwc_uint8(x):
+    return np.asarray(np.clip(x * 127.5 + 127.5, 0.0, 255.0), dtype=np.uint8).transpose((1, 2, 0))
+
 def img_to_hwc_array(img):
     return np.asarray(img.convert('RGBA')).astype("f") / 127.5 - 1.0
 
@@ -64,10 +67,14 @@ def align_2x_nearest_neighbor_scaled_image(img):
     return img.resize((w // 2, h // 2), Image.NEAREST).resize((w, h), Image.NEAREST)
 
 def pad_by_multiply_of(img, factor=64, add=0):
+    '''
+    reflect-pad img to a multiple of factor (int or (w, h)) and then by add on each side
+    '''
+    fw, fh = _pair(factor)
     img = np.asarray(img)
     h, w, c = img.shape
-    nw = factor * math.ceil(w / factor)
-    nh = factor * math.ceil(h / factor)
+    nw = fw * math.ceil(w / fw)
+    nh = fh * math.ceil(h / fh)
     ph = nh - h
     pw = nw - w
     img = np.pad(img, [
@@ -85,12 +92,55 @@ def transparent_background(img):
                 img.putpixel((i, j), (0, 0, 0, 0))
     return img
 
+def extract_patches(x, size, stride):
+    '''
+    strided (n_i, n_j, C, size_h, size_w) view of CHW array x without copying
+    (size and stride are int or (w, h))
+    '''
+    size_w, size_h = _pair(size)
+    stride_w, stride_h = _pair(stride)
+    C, H, W = x.shape
+    n_i = (W - size_w) // stride_w + 1
+    n_j = (H - size_h) // stride_h + 1
+    s_c, s_h, s_w = x.strides
+    return np.lib.stride_tricks.as_strided(
+        x,
+        shape=(n_i, n_j, C, size_h, size_w),
+        strides=(s_w * stride_w, s_h * stride_h, s_c, s_h, s_w),
+        writeable=False,
+    )
+
+def nearest_index(n_src, n_dst):
+    '''
+    source index of each pixel of an Image.NEAREST resize from n_src to n_dst pixels
+    '''
+    idx = Image.fromarray(np.arange(n_src, dtype=np.int32)[None, :])
+    return np.asarray(idx.resize((n_dst, 1), Image.NEAREST), dtype=np.intp)[0]
+
+def reflect_index(i, n):
+    '''
+    index into an axis of n pixels of positions i of its np.pad(mode='reflect') extension
+    '''
+    if n == 1:
+        return np.zeros_like(i)
+    i = np.abs(i) % (2 * (n - 1))
+    return np.where(i < n, i, 2 * (n - 1) - i)
+
+def _pair(x):
+    return tuple(x) if isinstance(x, (tuple, list)) else (x, x)
+
 # https://stackoverflow.com/a/24527424
 def chunks(iterable, size):
     iterator = iter(iterable)
     for first in iterator:
         yield itertools.chain([first], itertools.islice(iterator, size - 1))
 
+def png_save_options(compress_level=None):
+    '''
+    keyword arguments of Image.save for PNG output (zlib default level if None)
+    '''
+    return {} if compress_level is None else {'compress_level': compress_level}
+
 if __name__ == '__main__':
     r = 2
     h, w, c = 8, 16, 4
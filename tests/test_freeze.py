@@ -0,0 +1,59 @@
+import io
+import threading
+import urllib.request
+
+import chainer
+import numpy as np
+import pytest
+from PIL import Image
+
+import pixcaler.net
+from pixcaler.autotune import autotune, load_profile
+from pixcaler.serve import Model, RequestHandler, ThreadingHTTPServer
+from pixcaler.util import png_save_options
+
+
+@pytest.fixture(scope='module')
+def frozen_npz(tmp_path_factory):
+    np.random.seed(0)
+    path = tmp_path_factory.mktemp('gen')/'gen_frozen.npz'
+    chainer.serializers.save_npz(str(path), pixcaler.net.Generator(4, 4, base_ch=16).freeze())
+    return path
+
+def test_freeze_frozen_generator(frozen_npz):
+    gen = pixcaler.net.load_generator(frozen_npz)
+    assert isinstance(gen, pixcaler.net.FrozenGenerator)
+    assert gen.freeze() is gen
+
+def _post(port, path, body):
+    request = urllib.request.Request('http://127.0.0.1:{}{}'.format(port, path), data=body, method='POST')
+    with urllib.request.urlopen(request) as response:
+        return response.status, response.read()
+
+def test_serve_freeze_frozen_generator(frozen_npz):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), RequestHandler)
+    server.models = {'0': Model(frozen_npz, patch_size=32, freeze=True)}
+    server.default_model = '0'
+    server.save_options = png_save_options()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        img = Image.fromarray(np.random.RandomState(0).randint(256, size=(48, 40, 4), dtype=np.uint8), 'RGBA')
+        body = io.BytesIO()
+        img.save(body, format='PNG')
+        status, png = _post(server.server_address[1], '/up', body.getvalue())
+    finally:
+        server.shutdown()
+        server.server_close()
+        server.models['0'].loaded.scheduler.close()
+    assert status == 200
+    assert Image.open(io.BytesIO(png)).size == (80, 96)
+
+def test_autotune_freeze_frozen_generator(frozen_npz, tmp_path):
+    out = tmp_path/'autotune.json'
+    autotune(
+        generator=str(frozen_npz), backends='chainer', batch_sizes=1, patch_sizes=32,
+        image_size=64, repeat=1, freeze=True, out=str(out),
+    )
+    tuned = load_profile(out)['chainer']
+    assert tuned['freeze'] and tuned['base_ch'] == 16
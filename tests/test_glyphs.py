@@ -0,0 +1,87 @@
+import os
+from pathlib import Path
+
+import numpy as np
+import pytest
+from PIL import Image, ImageDraw, ImageFont
+
+import pixcaler.charset
+import pixcaler.glyphs
+from pixcaler.glyphs import HAS_ATLAS, GlyphAtlas, TextDrawer, load_drawer
+
+# ascii with kerning pairs (AV, To, Ty), a few kanji and kana, which
+# latin fonts draw as notdef, and a noncharacter
+CHARS = pixcaler.charset.HN_ASCII + pixcaler.charset.KANJI[:8] + pixcaler.charset.ZN_HIRAKANA[:8] + pixcaler.glyphs.MISSING
+
+def _fonts():
+    '''
+    fonts of PIXCALER_TEST_FONTS (separated by os.pathsep) or of the usual system directories
+    '''
+    if os.environ.get('PIXCALER_TEST_FONTS'):
+        return [Path(p) for p in os.environ['PIXCALER_TEST_FONTS'].split(os.pathsep)]
+    dirs = ['/usr/share/fonts', '/usr/local/share/fonts', '/Library/Fonts', 'C:/Windows/Fonts']
+    return sorted(p for d in dirs for p in Path(d).glob('**/*.ttf'))[:2]
+
+FONTS = _fonts()
+
+pytestmark = pytest.mark.skipif(not FONTS, reason='no TrueType font found (set PIXCALER_TEST_FONTS)')
+
+# lines with pairs most kern tables kern
+KERNED = ['AVAWAY', 'ToTyTr', 'LT.LY', 'V.W,Yo']
+
+def _samples(n, seed):
+    rs = np.random.RandomState(seed)
+    yield 30, [[CHARS.index(c) for c in line] for line in KERNED], (0, 0, 0)
+    for _ in range(n):
+        size = rs.randint(32, 64) * 3 // 4
+        lines = [rs.randint(len(CHARS), size=rs.randint(1, 6)) for _ in range(4)]
+        color = tuple(int(v) for v in rs.randint(256, size=3))
+        yield size, lines, color
+
+def _image_draw(font, lines, size, color):
+    img = Image.new('RGBA', size)
+    txt = ''.join(''.join(CHARS[i] for i in line) + '\n' for line in lines)
+    ImageDraw.Draw(img).text((0, 0), txt, font=font, fill=color + (255,))
+    return np.asarray(img)
+
+@pytest.mark.skipif(not HAS_ATLAS, reason='GlyphAtlas needs Pillow 9.1')
+@pytest.mark.parametrize('path', FONTS, ids=lambda p: p.name)
+def test_atlas_draws_as_image_draw(path, tmp_path):
+    atlases = {}
+    for size, lines, color in _samples(40, seed=0):
+        if size not in atlases:
+            atlases[size] = GlyphAtlas.load(path, size, CHARS, tmp_path)
+        font = ImageFont.truetype(str(path), size, layout_engine=ImageFont.Layout.BASIC)
+        expected = _image_draw(font, lines, (128, 128), color)
+        np.testing.assert_array_equal(atlases[size].draw(lines, (128, 128), color), expected)
+
+@pytest.mark.skipif(not HAS_ATLAS, reason='GlyphAtlas needs Pillow 9.1')
+@pytest.mark.parametrize('path', FONTS, ids=lambda p: p.name)
+def test_atlas_kerning(path, tmp_path):
+    # kerning is a fraction of a pixel at these sizes and seldom moves the
+    # drawn glyphs, so the advances are compared with Pillow's directly
+    atlas = GlyphAtlas.load(path, 30, CHARS, tmp_path)
+    font = ImageFont.truetype(str(path), 30, layout_engine=ImageFont.Layout.BASIC)
+    for line in KERNED:
+        for a, b in zip(line, line[1:]):
+            i, j = CHARS.index(a), CHARS.index(b)
+            advance = atlas.glyphs[i][5] + atlas.kern(i, j) + atlas.glyphs[j][5]
+            assert advance == round(font.getlength(a + b) * 64), a + b
+
+@pytest.mark.skipif(not HAS_ATLAS, reason='GlyphAtlas needs Pillow 9.1')
+def test_atlas_cache(tmp_path):
+    rendered = GlyphAtlas.load(FONTS[0], 30, CHARS, tmp_path)
+    assert len(list(tmp_path.glob('*.npz'))) == 1
+    loaded = GlyphAtlas.load(FONTS[0], 30, CHARS, tmp_path)
+    np.testing.assert_array_equal(loaded.masks, rendered.masks)
+    assert loaded.glyphs == rendered.glyphs
+    assert loaded.line_spacing == rendered.line_spacing
+
+def test_text_drawer_fallback(tmp_path, monkeypatch):
+    monkeypatch.setattr(pixcaler.glyphs, 'HAS_ATLAS', False)
+    drawer = load_drawer(FONTS[0], 30, CHARS, tmp_path)
+    assert isinstance(drawer, TextDrawer)
+    assert not list(tmp_path.iterdir())
+    font = ImageFont.truetype(str(FONTS[0]), 30)
+    for _, lines, color in _samples(5, seed=1):
+        np.testing.assert_array_equal(drawer.draw(lines, (128, 128), color), _image_draw(font, lines, (128, 128), color))
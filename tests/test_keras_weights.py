@@ -0,0 +1,71 @@
+import numpy as np
+import pytest
+
+keras = pytest.importorskip('keras')
+if not hasattr(keras.layers, 'advanced_activations'):
+    pytest.skip('pixcaler.keras.model needs the Keras 2.1 layer modules', allow_module_level=True)
+
+import chainer
+
+import pixcaler.net
+import pixcaler.keras.model
+from pixcaler.keras.weights import chainer_layers, from_keras, keras_layers, to_keras
+
+SIZE = 64
+
+def _keras_generator(in_ch, out_ch, base_ch):
+    x, h = pixcaler.keras.model.generator(SIZE, in_ch, out_ch, base_ch)
+    return keras.models.Model(x, h)
+
+def _randomize_chainer(gen, rs):
+    # random biases and batch normalization statistics so that a mixed up
+    # layer or axis cannot go unnoticed
+    for c, bn in chainer_layers(gen):
+        c.b.data[...] = rs.uniform(-0.1, 0.1, c.b.shape)
+        if bn is not None:
+            bn.gamma.data[...] = rs.uniform(0.5, 1.5, bn.gamma.shape)
+            bn.beta.data[...] = rs.uniform(-0.1, 0.1, bn.beta.shape)
+            bn.avg_mean[...] = rs.uniform(-0.1, 0.1, bn.avg_mean.shape)
+            bn.avg_var[...] = rs.uniform(0.5, 1.5, bn.avg_var.shape)
+
+def _randomize_keras(model, rs):
+    for layer in model.layers:
+        weights = layer.get_weights()
+        if weights:
+            layer.set_weights([rs.uniform(0.5, 1.5, w.shape).astype(w.dtype) if w.ndim == 1 else w for w in weights])
+    convs, _ = keras_layers(model)
+    for conv in convs:
+        W, b = conv.get_weights()
+        conv.set_weights([W, rs.uniform(-0.1, 0.1, b.shape).astype(b.dtype)])
+
+def _outputs(gen, model, rs):
+    x = rs.uniform(-1, 1, (2, gen.in_ch, SIZE, SIZE)).astype('f')
+    with chainer.using_config('train', False), chainer.using_config('enable_back_prop', False):
+        y_chainer = gen(x).data
+    y_keras = model.predict(x.transpose((0, 2, 3, 1)), verbose=0).transpose((0, 3, 1, 2))
+    return y_chainer, y_keras
+
+def test_to_keras():
+    rs = np.random.RandomState(0)
+    gen = pixcaler.net.Generator(4, 4, base_ch=8)
+    _randomize_chainer(gen, rs)
+    model = _keras_generator(4, 4, 8)
+    to_keras(gen, model)
+
+    y_chainer, y_keras = _outputs(gen, model, rs)
+    np.testing.assert_allclose(y_keras, y_chainer, rtol=1e-3, atol=1e-4)
+
+def test_from_keras():
+    rs = np.random.RandomState(1)
+    model = _keras_generator(4, 4, 8)
+    _randomize_keras(model, rs)
+    gen = pixcaler.net.Generator(4, 4, base_ch=8)
+    from_keras(model, gen)
+
+    y_chainer, y_keras = _outputs(gen, model, rs)
+    np.testing.assert_allclose(y_chainer, y_keras, rtol=1e-3, atol=1e-4)
+
+def test_frozen_generator_is_rejected():
+    gen = pixcaler.net.Generator(4, 4, base_ch=8)
+    with pytest.raises(ValueError):
+        to_keras(gen.freeze(), _keras_generator(4, 4, 8))
@@ -0,0 +1,49 @@
+import numpy as np
+import pytest
+
+pytest.importorskip('onnx')
+pytest.importorskip('onnxruntime')
+
+from pixcaler.net import Generator
+from pixcaler.onnx_backend import OnnxConverter, export_generator, quantize_model
+from pixcaler.scaler import ChainerConverter
+
+
+@pytest.fixture(scope='module')
+def converters():
+    np.random.seed(0)
+    gen = Generator(4, 4, base_ch=16)
+    model = export_generator(gen).SerializeToString()
+    return ChainerConverter(gen, 64), OnnxConverter(model, 64), model
+
+@pytest.mark.parametrize('shape', [(3, 4, 64, 64), (2, 4, 128, 64), (1, 4, 64, 192)])
+def test_onnx_matches_chainer(converters, shape):
+    chainer_converter, onnx_converter, _ = converters
+    x = np.random.RandomState(1).uniform(-1, 1, shape).astype(np.float32)
+
+    expected = chainer_converter.convert_array(x)
+    actual = onnx_converter.convert_array(x)
+
+    assert actual.shape == expected.shape == shape
+    np.testing.assert_allclose(actual, expected, rtol=1e-4, atol=1e-4)
+
+def test_onnx_metadata(converters):
+    chainer_converter, onnx_converter, _ = converters
+    assert onnx_converter.get_size_unit() == chainer_converter.get_size_unit()
+    assert onnx_converter.estimate_memory(128, 64, 2) == chainer_converter.estimate_memory(128, 64, 2)
+
+def test_quantized_model(converters):
+    import onnx
+
+    chainer_converter, _, model = converters
+    quantized = quantize_model(model)
+    ops = set(node.op_type for node in onnx.load_model_from_string(quantized).graph.node)
+    assert 'ConvInteger' in ops and 'Conv' not in ops
+    x = np.random.RandomState(2).uniform(-1, 1, (2, 4, 128, 64)).astype(np.float32)
+
+    expected = chainer_converter.convert_array(x)
+    actual = OnnxConverter(quantized, 64).convert_array(x)
+
+    assert actual.shape == expected.shape
+    # about one 8-bit level of the output range
+    np.testing.assert_allclose(actual, expected, atol=2 / 255)